@@ -1,19 +1,40 @@
 from abc import ABC, abstractmethod
 import random
 
+from agent import solvers
+from agent.transition_cache import shared_cache
 from dice_game import DiceGame
 import numpy as np
 
 
 class DiceGameAgent(ABC):
-    def __init__(self, game):
+    def __init__(self, game, transition_cache=None):
+        """
+        Parameters:
+            game (DiceGame): The game that the agent will play.
+            transition_cache (TransitionCache): The cache of the next states of the game, by default
+                the one shared by every agent, see agent.transition_cache.
+        """
         self.game = game
-        self.local_cache = {}
+        self.transition_cache = shared_cache if transition_cache is None else transition_cache
+        self.cache_hits = 0
+        self.cache_misses = 0
 
     @abstractmethod
     def play(self, state):
         pass
 
+    def play_many(self, states):
+        """Choose the action of many states at once.
+
+        Args:
+            states (list): The states, as tuples of dice values or an array of shape (n, dice).
+
+        Returns:
+            (np.ndarray): The id of the action of each state, see DiceGame.get_action.
+        """
+        return np.array([self.game.get_action_id(self.play(tuple(state))) for state in states], dtype=np.int64)
+
     def get_next_state(self, action, state):
         """Retrieve the next states, game over status and reward for the given action and state.
 
@@ -24,9 +45,23 @@ class DiceGameAgent(ABC):
         Returns:
         tuple: A tuple containing the list of next states, game over status (bool) and reward (float).
         """
-        if (action, state) not in self.local_cache:
-            self.local_cache[(action, state)] = self.game.get_next_states(action, state)
-        return self.local_cache[(action, state)]
+        misses = self.transition_cache.misses
+        entry = self.transition_cache.get_next_states(self.game, action, state)
+        if self.transition_cache.misses > misses:
+            self.cache_misses += 1
+        else:
+            self.cache_hits += 1
+        return entry
+
+    def cache_info(self):
+        """Report the use of the transition cache by this agent, and the size of the cache.
+
+        Returns:
+            (dict): The number of hits and misses of this agent, and the number of entries and the
+                estimated memory in bytes of the cache, which may be shared with other agents.
+        """
+        info = self.transition_cache.info()
+        return dict(hits=self.cache_hits, misses=self.cache_misses, entries=info["entries"], nbytes=info["nbytes"])
 
 
 class AlwaysHoldAgent(DiceGameAgent):
@@ -46,29 +81,192 @@ class MyAgent(DiceGameAgent):
     """An AI agent for playing a dice game.
     This agent uses the value iteration algorithm to find the optimal policy.
     """
-    def __init__(self, game, theta=1.1, gamma=0.975):
+    SOLVERS = ("value_iteration",) + tuple(solvers.SOLVERS)
+
+    def __init__(self, game, theta=1.1, gamma=0.975, solver="value_iteration", cache=None,
+                 callback=None, max_sweeps=None, time_budget=None, transition_cache=None, tolerance=None,
+                 max_outcomes=None, _solution=None):
         """
         Parameters:
             game (DiceGame): The game that the agent will play.
             theta (float): The threshold for the convergence of the value iteration algorithm.
             gamma (float): The discount factor for future rewards.
+            solver (str): "value_iteration" to loop over states and actions, or the name of a solver of
+                agent.solvers working on the game's transition model: "vectorized" to run each sweep
+                as whole-array operations, which gives the policy of the loop for a tight theta only,
+                see solvers.vectorized_value_iteration, "policy_iteration", "modified_policy_iteration",
+                "gauss_seidel" or "prioritized_sweeping", or "afterstate" to back up each distinct multiset
+                of held dice once per sweep, working on the game's afterstate model instead.
+                The solvers do not all converge to the same agent. "value_iteration" and "vectorized"
+                overwrite the value of a state with the running maximum while its actions are scanned,
+                so an action that may reroll into the same state is valued with the actions before it.
+                The other solvers back up every action from the same values, which has another fixed point.
+                On DiceGame() at theta=1e-6 the values differ by up to 0.91. The policies differ in 1 state
+                at gamma=0.975 (expected score 13.347 for the loop, 13.337 for the others) and in 5 states
+                at gamma=0.95 (13.204 for the loop, 13.309 for the others).
+            cache (PolicyCache): Optional on-disk cache to load the solved policy from, or store it in.
+            callback (callable): Optional function called after each sweep of the solver with its statistics,
+                see solvers.SolverMonitor.
+            max_sweeps (int): Optional largest number of sweeps of the solver.
+            time_budget (float): Optional largest solve time in seconds. A solve stopped by max_sweeps or
+                time_budget keeps the values and policy it has reached and is not stored in the cache,
+                nor is a warm-started solve of update.
+            transition_cache (TransitionCache): The cache of next states used by the "value_iteration" solver,
+                by default the one shared by every agent.
+            tolerance (float): Optional probability mass of the least likely outcomes of each action to drop,
+                solving on game.get_truncated_transition_model instead of the exact model. The solve is then
+                approximate, with error_bound bounding the error of its state values. The bound is tightest
+                with the solvers whose values are a fixed point of the synchronous backup: "policy_iteration",
+                "modified_policy_iteration" and "gauss_seidel".
+            max_outcomes (int): Optional largest number of outcomes kept per action, also solving approximately.
+            _solution (tuple): Values and policy already solved for these parameters, used instead of solving,
+                see for_gammas.
         """
-        super().__init__(game)
+        if solver not in self.SOLVERS:
+            raise ValueError(f"solver must be one of {self.SOLVERS}")
+        if solver in ("value_iteration", "afterstate") and (tolerance is not None or max_outcomes is not None):
+            raise ValueError("tolerance and max_outcomes need a solver working on the transition model")
+        super().__init__(game, transition_cache)
         self.__theta = theta
         self.__gamma = gamma
-        self.__perform_value_iteration()
+        self.__solver = solver
+        self.__cache = cache
+        self.__budget = dict(callback=callback, max_sweeps=max_sweeps, time_budget=time_budget)
+        self.__truncation = None
+        if tolerance is not None or max_outcomes is not None:
+            self.__truncation = dict(tolerance=tolerance or 0.0, max_outcomes=max_outcomes)
+        if _solution is None:
+            self.__solve()
+        else:
+            self.monitor = solvers.SolverMonitor()
+            self.__set_solution(*_solution)
+            self.__error_bound = None
+
+    def update(self, bias=None, penalty=None, gamma=None, theta=None):
+        """Re-solve the agent for new parameters, starting from its current values and policy.
+
+        A new bias or penalty replaces the agent's game with game.with_parameters, which only
+        rebuilds the part of the transition model that changed. A small change then converges
+        in a few sweeps instead of a full solve from zero.
+
+        Args:
+            bias (list): The new bias of the dice, or None to keep it.
+            penalty (float): The new penalty of a reroll, or None to keep it.
+            gamma (float): The new discount factor, or None to keep it.
+            theta (float): The new convergence threshold, or None to keep it.
+
+        Returns:
+            (DiceGame): The game the agent now plays.
+        """
+        if bias is not None or penalty is not None:
+            self.game = self.game.with_parameters(bias=bias, penalty=penalty)
+        if gamma is not None:
+            self.__gamma = gamma
+        if theta is not None:
+            self.__theta = theta
+        self.__solve(self.__values, self.__policy)
+        return self.game
+
+    @property
+    def sweeps(self):
+        """The statistics of each sweep of the last solve, empty if the solution was loaded from the cache."""
+        return self.monitor.sweeps
+
+    @property
+    def converged(self):
+        """Whether the last solve converged, rather than being stopped by max_sweeps or time_budget."""
+        return not self.monitor.exhausted
+
+    @property
+    def error_bound(self):
+        """A guaranteed bound on the error of any state value against the exact solution of the game,
+        for an agent solved with tolerance or max_outcomes, else None. See solvers.value_error_bound."""
+        return self.__error_bound
+
+    def __solve(self, values=None, policy=None):
+        self.monitor = solvers.SolverMonitor(**self.__budget)
+        solver = self.__solver
+        if self.__truncation is not None:
+            solver += "/truncated-{tolerance}-{max_outcomes}".format(**self.__truncation)
+        entry = None
+        if self.__cache is not None:
+            key = self.__cache.key(self.game, self.__theta, self.__gamma, solver)
+            entry = self.__cache.load(key)
+        model = None
+        if self.__truncation is not None:
+            model = self.game.get_truncated_transition_model(**self.__truncation)
+        if entry is None:
+            if self.__solver == "value_iteration":
+                entry = self.__perform_value_iteration(values, policy)
+            else:
+                if self.__solver == "afterstate":
+                    solver_model = self.game.get_afterstate_model()
+                else:
+                    solver_model = self.game.get_transition_model() if model is None else model
+                entry = solvers.SOLVERS[self.__solver](solver_model, self.__gamma, self.__theta, values=values,
+                                                       policy=policy, monitor=self.monitor)
+            self.__set_solution(*entry)
+            # at a loose theta a warm start stops somewhere else than a solve from zero, so only the
+            # latter is stored and a cache hit does not depend on the history of the agent
+            if self.__cache is not None and self.converged and values is None:
+                self.__cache.store(key, self.__values, self.__policy)
+        else:
+            self.__set_solution(*entry)
+        self.__error_bound = None if model is None else solvers.value_error_bound(model, self.__values, self.__gamma)
+
+    @classmethod
+    def for_gammas(cls, game, gammas, theta=1.1):
+        """Build one agent per discount factor, solving all of them together.
+
+        Gives the same agents as MyAgent(game, theta, gamma, solver="vectorized") for each gamma,
+        but every Bellman sweep backs up all the discount factors at once. Like those agents,
+        they match the policy of the "value_iteration" loop only for a tight theta.
+
+        Args:
+            game (DiceGame): The game that the agents will play.
+            gammas (list): The discount factors, one agent each.
+            theta (float): The threshold for the convergence of the value iteration algorithm.
 
-    def __initialize_state_value_array_and_policy(self):
+        Returns:
+            (list): The agents, in the order of gammas.
+        """
+        values, policies = solvers.solve_gamma_grid(game.get_transition_model(), gammas, theta)
+        return [cls(game, theta=theta, gamma=gamma, solver="vectorized", _solution=(gamma_values, policy))
+                for gamma, gamma_values, policy in zip(gammas, values, policies)]
+
+    def __set_solution(self, values, policy):
+        # one entry per state id, with the smallest integer type holding every action id; arrays that
+        # already have these types, such as those memory-mapped from a PolicyCache, are kept uncopied
+        self.__values = np.asarray(values, dtype=float)
+        self.__policy = np.asarray(policy, dtype=np.min_scalar_type(len(self.game.actions) - 1))
+
+    @property
+    def values(self):
+        """The value of each state, indexed by state id."""
+        return self.__values
+
+    @property
+    def policy(self):
+        """The id of the action to take in each state, indexed by state id."""
+        return self.__policy
+
+    def __initialize_state_value_array_and_policy(self, values=None, policy=None):
         """Initialize the state-value array and policy dictionary for the value iteration algorithm.
+
+        Args:
+            values (np.ndarray): Optional value of each state to start from, in the order of game.states.
+            policy (np.ndarray): Optional action index of each state to start from.
+
         Returns:
-            (dict, dict): A tuple with a zero-state-value array and an empty policy for each initial state.
+            (dict, dict): A tuple with a zero-state-value array and an empty policy for each initial state,
+                or the given values and policy.
         """
         state_value_array = {}
-        policy = {}
-        for state in self.game.states:
-            state_value_array[state] = 0
-            policy[state] = ()
-        return state_value_array, policy
+        policy_dict = {}
+        for i, state in enumerate(self.game.states):
+            state_value_array[state] = 0 if values is None else float(values[i])
+            policy_dict[state] = () if policy is None else self.game.actions[policy[i]]
+        return state_value_array, policy_dict
 
     def __calculate_state_value_sum(self, state_value_array, current_state, states, game_over, reward, probabilities):
         """Calculate the expected state-value for the next state given the current state,
@@ -93,18 +291,26 @@ class MyAgent(DiceGameAgent):
                 state_value_sum += probability * (reward + self.__gamma * self.game.final_score(current_state))
         return state_value_sum
 
-    def __perform_value_iteration(self):
+    def __perform_value_iteration(self, values=None, policy=None):
         """Perform the value iteration algorithm to find the optimal policy for the current game.
 
         The value iteration algorithm is an iterative method to find the optimal policy for a given MDP (Markov Decision Process).
         The algorithm starts with initializing the state value array and policy to default values.
         Then, it iteratively updates the state value array and policy until the maximum change in the state value array is less than a given threshold (theta).
         The algorithm terminates when the maximum change is less than the threshold.
+
+        Args:
+            values (np.ndarray): Optional value of each state to start from, instead of zero.
+            policy (np.ndarray): Optional action index of each state to start from.
+
+        Returns:
+            (np.ndarray, np.ndarray): The value and the action index of each state, in the order of game.states.
         """
-        state_value_array, policy = self.__initialize_state_value_array_and_policy()
+        state_value_array, policy = self.__initialize_state_value_array_and_policy(values, policy)
         delta_max = self.__theta + 1
         while delta_max >= self.__theta:
             delta_max = 0
+            hits, misses = self.cache_hits, self.cache_misses
             for current_state in self.game.states:
                 current_state_value = state_value_array[current_state]
                 max_action = 0
@@ -118,11 +324,52 @@ class MyAgent(DiceGameAgent):
                         policy[current_state] = action
                     state_value_array[current_state] = max_action
                 delta_max = max(delta_max, abs(current_state_value - state_value_array[current_state]))
+            if self.monitor.record(delta_max, len(self.game.states) * len(self.game.actions),
+                                   cache_hits=self.cache_hits - hits, cache_misses=self.cache_misses - misses,
+                                   cache_bytes=self.cache_info()["nbytes"]):
+                break
 
-        self.__policy = policy
+        action_index = {action: i for i, action in enumerate(self.game.actions)}
+        values = np.array([state_value_array[state] for state in self.game.states], dtype=float)
+        return values, np.array([action_index[policy[state]] for state in self.game.states], dtype=np.int64)
 
     def play(self, state):
-        return self.__policy[state]
+        return self.game.actions[self.__policy[self.game.get_state_id(state)]]
+
+    def play_many(self, states):
+        """Choose the action of many states at once, with one vectorized lookup.
+
+        Args:
+            states (np.ndarray): The dice values of each state, of shape (n, dice), in any order.
+
+        Returns:
+            (np.ndarray): The id of the action of each state, see DiceGame.get_action.
+        """
+        return self.__policy[self.game.encode_states(np.asarray(states))]
+
+
+class CountAgent(DiceGameAgent):
+    """An AI agent for playing a CountDiceGame.
+    This agent uses value iteration over face-count states, backing up each multiset of kept dice
+    once per sweep, so it can solve games with many dice and sides.
+    """
+    def __init__(self, game, theta=1.1, gamma=0.975):
+        """
+        Parameters:
+            game (CountDiceGame): The game that the agent will play.
+            theta (float): The threshold for the convergence of the value iteration algorithm.
+            gamma (float): The discount factor for future rewards.
+        """
+        super().__init__(game)
+        lattice = game.get_lattice()
+        states = lattice.counts(lattice.size, np.arange(lattice.sizes[lattice.size]))
+        self.__values, self.__policy = solvers.lattice_value_iteration(
+            lattice, game.bias, game.final_scores(states), game.penalty, gamma, theta
+        )
+
+    def play(self, state):
+        level, rank = self.game.get_lattice().level_of(self.__policy[self.game.get_state_id(state)])
+        return tuple(int(count) for count in self.game.get_lattice().counts(level, rank))
 
 
 def play_game_with_agent(agent, game, verbose=False):
@@ -151,6 +398,26 @@ def play_game_with_agent(agent, game, verbose=False):
     return game.score
 
 
+def play_games_with_agent(agent, game, num_games, seed=None, max_rolls=None):
+    """Play many games at once with the policy of the given agent.
+
+    The agent is asked once for the actions of every state with play_many, then all games are
+    simulated together by DiceGame.simulate.
+
+    Args:
+        agent (DiceGameAgent): The agent whose policy is played.
+        game (DiceGame): The game to play.
+        num_games (int): The number of games to play.
+        seed (int): Seed or numpy Generator for the random draws.
+        max_rolls (int): If given, games still running after this many rerolls stick with their dice.
+
+    Returns:
+        (np.ndarray, np.ndarray): The final score and the number of rerolls of each game.
+    """
+    policy = agent.play_many(game.states)
+    return game.simulate(policy, num_games, seed=seed, max_rolls=max_rolls)
+
+
 def main():
     # random seed makes the results deterministic
     # change the number to see different results
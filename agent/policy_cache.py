@@ -0,0 +1,136 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+
+class PolicyCache:
+    """An on-disk cache of solved policies and state values.
+
+    Each entry is a directory named after its key, holding the state values and the
+    action index of each state as .npy files, which are loaded memory-mapped so a new
+    process can use them without reading or solving anything up front.
+    When the entries take more than max_bytes, the least recently used ones are evicted.
+    """
+    VALUES_FILE = "values.npy"
+    POLICY_FILE = "policy.npy"
+    # age after which a temporary directory is taken as left behind by a crashed store
+    STALE_SECONDS = 3600
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024):
+        """
+        Parameters:
+            directory (str): The directory holding the cache entries, created if missing.
+            max_bytes (int): The maximum total size of the entries on disk.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    @staticmethod
+    def key(game, theta, gamma, solver):
+        """Build the key of a solved game.
+
+        Args:
+            game (DiceGame): The game that was solved.
+            theta (float): The convergence threshold of the solver.
+            gamma (float): The discount factor of the solver.
+            solver (str): The name of the solver.
+
+        Returns:
+            (str): A hexadecimal digest of the game configuration and solver parameters.
+        """
+        config = repr((game.fingerprint(), float(theta), float(gamma), solver))
+        return hashlib.sha256(config.encode()).hexdigest()
+
+    def load(self, key):
+        """Load a cache entry, marking it as the most recently used.
+
+        Args:
+            key (str): The key of the entry.
+
+        Returns:
+            (np.ndarray, np.ndarray): Read-only memory-mapped state values and policy, or None if missing.
+                An entry that cannot be read is removed, so the next store replaces it.
+        """
+        path = os.path.join(self.directory, key)
+        if not os.path.isdir(path):
+            return None
+        try:
+            values = np.load(os.path.join(path, self.VALUES_FILE), mmap_mode="r")
+            policy = np.load(os.path.join(path, self.POLICY_FILE), mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            # entries are renamed into place complete, so this one is corrupt or was damaged on disk
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        return values, policy
+
+    def store(self, key, values, policy):
+        """Store a cache entry, then evict the least recently used entries over the size cap.
+
+        The entry is written to a temporary directory first and renamed into place,
+        so other processes never see a partially written entry.
+
+        Args:
+            key (str): The key of the entry.
+            values (np.ndarray): The value of each state.
+            policy (np.ndarray): The action index of each state, saved with its integer type.
+        """
+        path = os.path.join(self.directory, key)
+        policy = np.asarray(policy)
+        if not np.issubdtype(policy.dtype, np.integer):
+            policy = policy.astype(np.int64)
+        temporary = tempfile.mkdtemp(prefix=".tmp-", dir=self.directory)
+        try:
+            np.save(os.path.join(temporary, self.VALUES_FILE), np.asarray(values, dtype=float))
+            np.save(os.path.join(temporary, self.POLICY_FILE), policy)
+            os.rename(temporary, path)
+        except OSError:
+            # another process stored the same entry first
+            shutil.rmtree(temporary, ignore_errors=True)
+        self.evict(keep=key)
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits in max_bytes.
+
+        Temporary directories older than STALE_SECONDS, left behind by a store that crashed, are removed too.
+
+        Args:
+            keep (str): The key of an entry that must not be evicted.
+        """
+        entries = []
+        now = time.time()
+        for key in os.listdir(self.directory):
+            path = os.path.join(self.directory, key)
+            if key.startswith(".tmp-"):
+                try:
+                    if now - os.stat(path).st_mtime > self.STALE_SECONDS:
+                        shutil.rmtree(path, ignore_errors=True)
+                except FileNotFoundError:
+                    pass
+                continue
+            if key.startswith(".") or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(path))
+                entries.append((os.stat(path).st_mtime, size, key))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
+            total -= size
+
+    def clear(self):
+        """Remove every entry of the cache."""
+        for key in os.listdir(self.directory):
+            shutil.rmtree(os.path.join(self.directory, key), ignore_errors=True)
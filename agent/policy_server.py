@@ -0,0 +1,341 @@
+import argparse
+import asyncio
+from collections import deque
+import json
+import struct
+import time
+
+import numpy as np
+
+from agent.dice_game_agent import MyAgent
+from dice_game import DiceGame
+
+
+# Every message is a little-endian uint32 count followed by that many items: uint32 state ids in a
+# request, uint16 action ids (indices in DiceGame.actions) in the response. A response whose count is
+# ERROR carries no items and means the request held an invalid state id, or more than MAX_BATCH of
+# them, in which case the server closes the connection after it. A request whose count is STATS asks
+# for the counters of the server: the response is STATS followed by the uint32 length of the UTF-8
+# JSON of PolicyServer.stats and the JSON itself.
+HEADER = struct.Struct("<I")
+STATE_DTYPE = np.dtype("<u4")
+ACTION_DTYPE = np.dtype("<u2")
+ERROR = 0xFFFFFFFF
+STATS = 0xFFFFFFFE
+MAX_BATCH = 1 << 20
+
+
+class PolicyTable:
+    """The action id to take in each state id of a solved game."""
+    def __init__(self, policy, fingerprint=None):
+        """
+        Parameters:
+            policy (np.ndarray): The action index of each state, in the order of DiceGame.states.
+            fingerprint (str): The fingerprint of the game the policy was solved for, if known.
+        """
+        policy = np.asarray(policy)
+        if policy.size and policy.max() > np.iinfo(ACTION_DTYPE).max:
+            raise ValueError("action ids must fit in 16 bits")
+        self.policy = policy.astype(ACTION_DTYPE)
+        self.fingerprint = fingerprint
+
+    @classmethod
+    def from_agent(cls, agent):
+        """Build the table of an agent, asking it for the action of every state of its game.
+
+        Args:
+            agent (DiceGameAgent): The agent.
+
+        Returns:
+            (PolicyTable): The table of the agent's policy.
+        """
+        game = agent.game
+        return cls(agent.play_many(game.states), game.fingerprint())
+
+    @classmethod
+    def load(cls, path):
+        """Load a table saved by save, or the policy.npy file of a PolicyCache entry.
+
+        Args:
+            path (str): The path of the file.
+
+        Returns:
+            (PolicyTable): The loaded table.
+        """
+        if path.endswith(".npy"):
+            return cls(np.load(path))
+        with np.load(path) as data:
+            fingerprint = str(data["fingerprint"]) if "fingerprint" in data else None
+            return cls(data["policy"], fingerprint)
+
+    def save(self, path):
+        """Save the table to a .npz file.
+
+        Args:
+            path (str): The path of the file.
+        """
+        arrays = {"policy": self.policy}
+        if self.fingerprint is not None:
+            arrays["fingerprint"] = np.array(self.fingerprint)
+        np.savez(path, **arrays)
+
+    def lookup(self, state_ids):
+        """Get the action id of each state id, or None if any id is out of range."""
+        if state_ids.size and state_ids.max() >= len(self.policy):
+            return None
+        return self.policy[state_ids]
+
+
+class PolicyServer:
+    """An asyncio server answering batches of state ids with the action ids of a PolicyTable.
+
+    Any number of clients can be connected at once, each sending requests one after another
+    on its connection. The server counts the requests, states and errors it handles, and keeps
+    the latency of the last requests, from the arrival of a request to the write of its answer.
+    """
+    def __init__(self, table, latency_window=100000):
+        """
+        Parameters:
+            table (PolicyTable): The policy to serve.
+            latency_window (int): The number of most recent request latencies kept for the statistics.
+        """
+        self.table = table
+        self.requests = 0
+        self.states = 0
+        self.errors = 0
+        self.connections = 0
+        self.latencies = deque(maxlen=latency_window)
+        self._started = None
+        self._server = None
+        self._handlers = set()
+
+    async def start(self, host="127.0.0.1", port=0, path=None):
+        """Start listening on a TCP port of the host, or on a Unix socket if path is given.
+
+        Args:
+            host (str): The host to listen on.
+            port (int): The port to listen on, 0 for any free port.
+            path (str): The path of a Unix socket to listen on instead.
+
+        Returns:
+            (str or tuple): The socket path, or the (host, port) the server listens on.
+        """
+        self._started = time.perf_counter()
+        if path is not None:
+            self._server = await asyncio.start_unix_server(self._handle, path=path)
+            return path
+        self._server = await asyncio.start_server(self._handle, host, port)
+        return self._server.sockets[0].getsockname()[:2]
+
+    async def serve_forever(self):
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        """Stop listening and close the connections still open."""
+        self._server.close()
+        for handler in self._handlers:
+            handler.cancel()
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def stats(self):
+        """Report the counters of the server.
+
+        Returns:
+            (dict): The number of requests, states, errors and connections, the requests and states
+                answered per second since the start, and the mean, median and 99th percentile
+                latency in seconds of the most recent requests.
+        """
+        elapsed = time.perf_counter() - self._started if self._started is not None else 0.0
+        latencies = np.array(self.latencies) if self.latencies else np.zeros(1)
+        return dict(requests=self.requests, states=self.states, errors=self.errors, connections=self.connections,
+                    requests_per_second=self.requests / elapsed if elapsed else 0.0,
+                    states_per_second=self.states / elapsed if elapsed else 0.0,
+                    latency_mean=float(latencies.mean()), latency_p50=float(np.percentile(latencies, 50)),
+                    latency_p99=float(np.percentile(latencies, 99)))
+
+    async def _handle(self, reader, writer):
+        self.connections += 1
+        handler = asyncio.current_task()
+        self._handlers.add(handler)
+        try:
+            while True:
+                header = await reader.readexactly(HEADER.size)
+                start = time.perf_counter()
+                (count,) = HEADER.unpack(header)
+                if count == STATS:
+                    stats = json.dumps(self.stats()).encode()
+                    writer.write(HEADER.pack(STATS) + HEADER.pack(len(stats)) + stats)
+                    await writer.drain()
+                    continue
+                if count > MAX_BATCH:
+                    # the items of the request are not read, so the connection cannot go on
+                    self.errors += 1
+                    writer.write(HEADER.pack(ERROR))
+                    await writer.drain()
+                    break
+                state_ids = np.frombuffer(await reader.readexactly(count * STATE_DTYPE.itemsize), dtype=STATE_DTYPE)
+                actions = self.table.lookup(state_ids)
+                if actions is None:
+                    self.errors += 1
+                    writer.write(HEADER.pack(ERROR))
+                else:
+                    writer.write(HEADER.pack(count) + actions.tobytes())
+                await writer.drain()
+                self.requests += 1
+                self.states += count
+                self.latencies.append(time.perf_counter() - start)
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self._handlers.discard(handler)
+            writer.close()
+
+
+class PolicyClient:
+    """A connection to a PolicyServer."""
+    def __init__(self, reader, writer):
+        self._reader = reader
+        self._writer = writer
+
+    @classmethod
+    async def connect(cls, host="127.0.0.1", port=None, path=None):
+        """Connect to a server listening on a TCP port, or on a Unix socket if path is given."""
+        if path is not None:
+            return cls(*await asyncio.open_unix_connection(path))
+        return cls(*await asyncio.open_connection(host, port))
+
+    async def query(self, state_ids):
+        """Get the action id of each state id.
+
+        Args:
+            state_ids (np.ndarray): The state ids, as returned by DiceGame.get_state_id or encode_states.
+
+        Returns:
+            (np.ndarray): The action id of each state, see DiceGame.get_action.
+        """
+        state_ids = np.asarray(state_ids, dtype=STATE_DTYPE)
+        if len(state_ids) > MAX_BATCH:
+            raise ValueError(f"a query holds at most {MAX_BATCH} state ids")
+        self._writer.write(HEADER.pack(len(state_ids)) + state_ids.tobytes())
+        await self._writer.drain()
+        (count,) = HEADER.unpack(await self._reader.readexactly(HEADER.size))
+        if count == ERROR:
+            raise ValueError("state_ids must be valid state ids")
+        return np.frombuffer(await self._reader.readexactly(count * ACTION_DTYPE.itemsize), dtype=ACTION_DTYPE)
+
+    async def stats(self):
+        """Get the counters of the server, see PolicyServer.stats."""
+        self._writer.write(HEADER.pack(STATS))
+        await self._writer.drain()
+        (count,) = HEADER.unpack(await self._reader.readexactly(HEADER.size))
+        if count != STATS:
+            raise ValueError("the server did not answer with its statistics")
+        (length,) = HEADER.unpack(await self._reader.readexactly(HEADER.size))
+        return json.loads(await self._reader.readexactly(length))
+
+    async def close(self):
+        self._writer.close()
+        await self._writer.wait_closed()
+
+
+async def load_test(n_states, host="127.0.0.1", port=None, path=None, clients=16, requests=1000, batch=64,
+                    seed=None):
+    """Query a server from many concurrent clients, each sending random batches of state ids.
+
+    Args:
+        n_states (int): The number of states of the game served.
+        clients (int): The number of concurrent connections.
+        requests (int): The number of requests sent by each client.
+        batch (int): The number of state ids per request.
+        seed (int): Seed of the random state ids.
+
+    Returns:
+        (dict): The number of requests and states sent, the elapsed wall time, the requests and
+            states answered per second, and the median and 99th percentile round trip in seconds.
+    """
+    rng = np.random.default_rng(seed)
+    batches = rng.integers(n_states, size=(clients, requests, batch), dtype=STATE_DTYPE)
+    round_trips = []
+
+    async def run_client(client_batches):
+        client = await PolicyClient.connect(host, port, path)
+        try:
+            for state_ids in client_batches:
+                start = time.perf_counter()
+                await client.query(state_ids)
+                round_trips.append(time.perf_counter() - start)
+        finally:
+            await client.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(run_client(client_batches) for client_batches in batches))
+    elapsed = time.perf_counter() - start
+    total = clients * requests
+    return dict(requests=total, states=total * batch, seconds=elapsed, requests_per_second=total / elapsed,
+                states_per_second=total * batch / elapsed, round_trip_p50=float(np.percentile(round_trips, 50)),
+                round_trip_p99=float(np.percentile(round_trips, 99)))
+
+
+async def report_stats(server, interval):
+    """Print the counters of a server every interval seconds."""
+    while True:
+        await asyncio.sleep(interval)
+        print("server", server.stats(), flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the policy of a solved dice game over a local socket.")
+    parser.add_argument("--policy", help="a table saved by PolicyTable.save or a PolicyCache policy.npy file; "
+                                         "if missing, a game is solved with MyAgent")
+    parser.add_argument("--dice", type=int, default=3)
+    parser.add_argument("--sides", type=int, default=6)
+    parser.add_argument("--gamma", type=float, default=0.975)
+    parser.add_argument("--theta", type=float, default=0.001)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="listen on this Unix socket instead of a TCP port")
+    parser.add_argument("--load-test", action="store_true", help="run a local load test against the server and exit")
+    parser.add_argument("--stats-interval", type=float, default=60.0,
+                        help="seconds between two reports of the server counters while serving, 0 for none")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--batch", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    if args.policy is not None:
+        table = PolicyTable.load(args.policy)
+    else:
+        game = DiceGame(dice=args.dice, sides=args.sides)
+        table = PolicyTable.from_agent(MyAgent(game, theta=args.theta, gamma=args.gamma, solver="vectorized"))
+
+    async def run():
+        server = PolicyServer(table)
+        address = await server.start(args.host, 0 if args.load_test else args.port, args.unix)
+        if not args.load_test:
+            print(f"serving {len(table.policy)} states on {address}")
+            reporter = asyncio.create_task(report_stats(server, args.stats_interval)) if args.stats_interval else None
+            try:
+                await server.serve_forever()
+            finally:
+                # also reached on Ctrl-C, which cancels this task
+                if reporter is not None:
+                    reporter.cancel()
+                await server.stop()
+                print("server", server.stats())
+            return
+        port = None if args.unix else address[1]
+        print("client", await load_test(len(table.policy), args.host, port, args.unix, args.clients,
+                                        args.requests, args.batch))
+        print("server", server.stats())
+        await server.stop()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
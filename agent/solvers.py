@@ -0,0 +1,663 @@
+import time
+
+import numpy as np
+
+
+def row_sums(indptr, weights):
+    """Sum the given per-outcome weights over each row of a CSR structure.
+
+    Args:
+        indptr (np.ndarray): The offsets of each row, such as TransitionModel.indptr.
+        weights (np.ndarray): One weight per outcome, optionally with trailing dimensions.
+
+    Returns:
+        (np.ndarray): One sum per row, zero for rows without outcomes.
+    """
+    sums = np.zeros((len(indptr) - 1,) + weights.shape[1:], dtype=float)
+    starts = indptr[:-1]
+    non_empty = starts < indptr[1:]
+    if np.any(non_empty):
+        # reduceat sums from one start to the next, and empty rows add nothing in between
+        sums[non_empty] = np.add.reduceat(weights, starts[non_empty], axis=0)
+    return sums
+
+
+class SolverMonitor:
+    """Per-sweep statistics of a solver, with a callback and a budget of sweeps or time.
+
+    Solvers call record after every sweep. Each sweep is kept as a dict holding its number,
+    the largest change of a state value (delta_max), the number of (state, action) backups
+    (or state backups where no maximum is taken), its wall time in seconds and any extra
+    statistics the solver adds. Once the budget is spent, record returns True and the solver
+    stops with the values and policy it has, which may not have converged.
+    """
+    def __init__(self, callback=None, max_sweeps=None, time_budget=None):
+        """
+        Parameters:
+            callback (callable): Optional function called with the statistics of each sweep.
+            max_sweeps (int): Optional largest number of sweeps.
+            time_budget (float): Optional largest total wall time in seconds.
+        """
+        self.callback = callback
+        self.max_sweeps = max_sweeps
+        self.time_budget = time_budget
+        self.sweeps = []
+        self.exhausted = False
+        self._start = time.perf_counter()
+        self._last = self._start
+
+    def record(self, delta_max, backups, **extra):
+        """Record a finished sweep.
+
+        Args:
+            delta_max (float): The largest change of a state value in the sweep.
+            backups (int): The number of backups done in the sweep.
+            **extra: Other statistics of the sweep.
+
+        Returns:
+            (bool): True if the budget is spent and the solver must stop.
+        """
+        now = time.perf_counter()
+        stats = dict(sweep=len(self.sweeps) + 1, delta_max=float(delta_max), backups=int(backups),
+                     time=now - self._last, **extra)
+        self._last = now
+        self.sweeps.append(stats)
+        if self.callback is not None:
+            self.callback(stats)
+        self.exhausted = ((self.max_sweeps is not None and len(self.sweeps) >= self.max_sweeps)
+                          or (self.time_budget is not None and now - self._start >= self.time_budget))
+        return self.exhausted
+
+    @property
+    def total_time(self):
+        """The total wall time of the recorded sweeps."""
+        return sum(stats["time"] for stats in self.sweeps)
+
+
+def initial_solution(model, values=None, policy=None):
+    """Get writable copies of the state values and policy a solver starts from.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        values (np.ndarray): The state values to start from, zero if None.
+        policy (np.ndarray): The action indices to start from, zero if None.
+
+    Returns:
+        (np.ndarray, np.ndarray): The value and the action index of each state.
+    """
+    values = np.zeros(model.n_states, dtype=float) if values is None else np.array(values, dtype=float)
+    policy = np.zeros(model.n_states, dtype=np.int64) if policy is None else np.array(policy, dtype=np.int64)
+    return values, policy
+
+
+class BellmanOperator:
+    """Bellman backups of MyAgent applied to every state of a TransitionModel at once.
+
+    The backup follows the loop in MyAgent exactly: a terminal action is worth its reward
+    plus the discounted final score of the state, any other action is worth its reward plus
+    the discounted expected value of the next states. Like the loop, the value of a state is
+    overwritten with the running maximum while its actions are scanned in order, so outcomes
+    that lead back to the same state use that running maximum.
+
+    Several discount factors can be backed up together, with one column of state values each.
+    """
+    def __init__(self, model):
+        """
+        Parameters:
+            model (TransitionModel): The transition model of the game.
+        """
+        from scipy.sparse import csr_matrix
+
+        self.model = model
+
+        shape = (model.n_states, model.n_actions)
+        rows = np.repeat(np.arange(len(model.indptr) - 1), np.diff(model.indptr))
+        self_loop = model.next_states == rows // model.n_actions
+        # one sparse (row x state) matrix, so a sweep is a product with the (state x gamma) values
+        # and never builds a temporary per outcome and discount factor
+        self._transitions = csr_matrix((np.where(self_loop, 0.0, model.probabilities), model.next_states,
+                                        model.indptr), shape=(len(model.indptr) - 1, model.n_states))
+        self._self_probabilities = row_sums(model.indptr, np.where(self_loop, model.probabilities, 0.0)).reshape(shape)
+        self._rewards = model.rewards.reshape(shape)
+        self._game_over = model.game_over.reshape(shape)
+
+    def sweep(self, values, policy, gamma):
+        """Apply one Bellman sweep to every state.
+
+        Args:
+            values (np.ndarray): The current value of each state, or an array of shape
+                (n_states, n_gammas) with one column per discount factor.
+            policy (np.ndarray): The current action index of each state, shaped like values.
+            gamma (float): The discount factor for future rewards, or an array with one per column.
+
+        Returns:
+            (np.ndarray, np.ndarray): The new state values and the new policy, shaped like values.
+        """
+        model = self.model
+        shape = values.shape
+        values = values.reshape(model.n_states, -1)
+        gamma = np.reshape(gamma, -1)
+
+        expected = np.asarray(self._transitions @ values).reshape(model.n_states, model.n_actions, -1)
+
+        best = np.zeros_like(values)
+        policy = policy.reshape(values.shape).copy()
+        own_values = values
+        for action in range(model.n_actions):
+            future = np.where(self._game_over[:, action, None], model.final_scores[:, None],
+                              expected[:, action] + self._self_probabilities[:, action, None] * own_values)
+            action_values = self._rewards[:, action, None] + gamma * future
+            improved = action_values > best
+            best = np.where(improved, action_values, best)
+            policy[improved] = action
+            own_values = best
+        return best.reshape(shape), policy.reshape(shape)
+
+
+def vectorized_value_iteration(model, gamma, theta, values=None, policy=None, monitor=None):
+    """Perform value iteration with every Bellman sweep done as whole-array operations.
+
+    Each sweep is a sparse matrix-vector product over the transition model followed by
+    a maximum over the actions, on state values indexed like DiceGame.states.
+    It backs up every (state, action) pair like the loop in MyAgent. The loop, though, updates
+    the states one after another within a sweep, while this sweep updates all of them from the
+    values of the previous one. Both approach the same fixed point, but they stop at different
+    places. With a tight theta (1e-3 on DiceGame()) the policies are the same. With a loose one
+    they can differ: at the default theta=1.1 of MyAgent, 9 of the 56 states of DiceGame() take
+    another action.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        gamma (float): The discount factor for future rewards.
+        theta (float): The threshold for the convergence of the algorithm.
+        values (np.ndarray): Optional state values to start from, such as those of a previous solve.
+        policy (np.ndarray): Optional action indices to start from, used with values.
+        monitor (SolverMonitor): Optional monitor recording each sweep, which can also stop the solver early.
+
+    Returns:
+        (np.ndarray, np.ndarray): The value and the action index of each state.
+    """
+    if values is not None:
+        values, policy = initial_solution(model, values, policy)
+        values, policy = values[None], policy[None]
+    values, policy = solve_gamma_grid(model, [gamma], theta, values, policy, monitor)
+    return values[0], policy[0]
+
+
+def solve_gamma_grid(model, gammas, theta, values=None, policy=None, monitor=None):
+    """Perform vectorized value iteration for many discount factors together.
+
+    The values of every discount factor are held in one (state x gamma) array, backed up by
+    the same sparse sweeps. A discount factor stops being updated once its own change falls
+    below theta, so each one gets exactly the values and policy of vectorized_value_iteration.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        gammas (list): The discount factors to solve for.
+        theta (float): The threshold for the convergence of the algorithm.
+        values (np.ndarray): Optional state values to start from, of shape (n_gammas, n_states).
+        policy (np.ndarray): Optional action indices to start from, of shape (n_gammas, n_states).
+        monitor (SolverMonitor): Optional monitor recording each sweep, which can also stop the solver early.
+
+    Returns:
+        (np.ndarray, np.ndarray): Arrays of shape (n_gammas, n_states) with the value and the
+            action index of each state, one row per discount factor.
+    """
+    gammas = np.asarray(gammas, dtype=float)
+    operator = BellmanOperator(model)
+    if values is None:
+        values = np.zeros((len(gammas), model.n_states), dtype=float)
+        policy = np.zeros((len(gammas), model.n_states), dtype=np.int64)
+    values = np.array(values, dtype=float).T.copy()
+    policy = np.array(policy, dtype=np.int64).T.copy()
+    active = np.ones(len(gammas), dtype=bool)
+    while np.any(active):
+        new_values, new_policy = operator.sweep(values[:, active], policy[:, active], gammas[active])
+        delta_max = np.max(np.abs(new_values - values[:, active]), axis=0)
+        values[:, active] = new_values
+        policy[:, active] = new_policy
+        backups = np.count_nonzero(active) * model.n_states * model.n_actions
+        active[active] = delta_max >= theta
+        if monitor is not None and monitor.record(delta_max.max(), backups, active=int(np.count_nonzero(active))):
+            break
+    return values.T, policy.T
+
+
+def lattice_value_iteration(lattice, bias, final_scores, penalty, gamma, theta):
+    """Perform value iteration over face-count states, backing up afterstates instead of actions.
+
+    An action keeps a sub-multiset of the dice, its afterstate, and the value of rerolling the
+    rest only depends on that afterstate. Expected values are built level by level, adding one
+    rerolled die at a time, and the best afterstate below each multiset is found by removing one
+    die at a time, so a sweep costs a few operations per multiset of the lattice and per face,
+    however many actions each state has. A terminal action is worth the final score plus its
+    discounted value and values keep a zero floor, as in MyAgent.
+
+    Args:
+        lattice (MultisetLattice): The lattice of the game, whose top level are the states.
+        bias (np.ndarray): The probability of each face.
+        final_scores (np.ndarray): The final score of each state.
+        penalty (float): The cost of a reroll.
+        gamma (float): The discount factor for future rewards.
+        theta (float): The threshold for the convergence of the algorithm.
+
+    Returns:
+        (np.ndarray, np.ndarray): The value of each state and the global lattice id of the
+            multiset it keeps, which is the state itself when it sticks.
+    """
+    dice = lattice.size
+    children = [lattice.children(level) for level in range(dice)]
+    parents = [None] + [lattice.parents(level) for level in range(1, dice + 1)]
+    state_ids = lattice.offsets[dice] + np.arange(lattice.sizes[dice])
+    stick_values = (1 + gamma) * final_scores
+
+    values = np.zeros(lattice.sizes[dice], dtype=float)
+    policy = np.full(lattice.sizes[dice], lattice.offsets[0], dtype=np.int64)
+    delta_max = theta + 1
+    while delta_max >= theta:
+        # expected value of rerolling the missing dice of every multiset, from the fullest level down
+        expected = [values]
+        for level in reversed(range(dice)):
+            expected.insert(0, expected[0][children[level]] @ bias)
+
+        # best multiset to keep among the sub-multisets of every multiset, from the emptiest level up,
+        # where below is the best one with at least one die removed
+        best, best_ids = expected[0], lattice.offsets[:1]
+        for level in range(1, dice + 1):
+            below = np.append(best, -np.inf)[parents[level]]
+            below_ids = np.append(best_ids, -1)[parents[level]]
+            rows = np.arange(len(below))
+            face = np.argmax(below, axis=1)
+            below, below_ids = below[rows, face], below_ids[rows, face]
+            own = expected[level] > below
+            best = np.where(own, expected[level], below)
+            best_ids = np.where(own, lattice.offsets[level] + rows, below_ids)
+
+        reroll_values = -penalty + gamma * below
+        sticks = stick_values > reroll_values
+        action_values = np.where(sticks, stick_values, reroll_values)
+        improved = action_values > 0
+        new_values = np.where(improved, action_values, 0.0)
+        policy = np.where(improved, np.where(sticks, state_ids, below_ids), policy)
+
+        delta_max = np.max(np.abs(new_values - values))
+        values = new_values
+    return values, policy
+
+
+def afterstate_value_iteration(model, gamma, theta, values=None, policy=None, monitor=None):
+    """Perform value iteration computing the expected value of each afterstate once per sweep.
+
+    The expected value of rerolling the dice not held is built level by level over the lattice
+    of the model, adding one rerolled die at a time, so every multiset of held dice costs one
+    product with the bias per sweep, however many (state, action) pairs reach it. Each state
+    then takes the maximum over its distinct afterstates only, duplicate actions being
+    collapsed into the first one. The backup is the synchronous one of action_values and
+    greedy_policy, so it converges to the same state values and policy as policy_iteration
+    and gauss_seidel.
+
+    Args:
+        model (AfterstateModel): The afterstate model of the game.
+        gamma (float): The discount factor for future rewards.
+        theta (float): The threshold for the convergence of the algorithm.
+        values (np.ndarray): Optional state values to start from, such as those of a previous solve.
+        policy (np.ndarray): Optional action indices to start from, used with values.
+        monitor (SolverMonitor): Optional monitor recording each sweep, which can also stop the solver early.
+
+    Returns:
+        (np.ndarray, np.ndarray): The value and the action index of each state.
+    """
+    lattice = model.lattice
+    dice = lattice.size
+    children = [lattice.children(level) for level in range(dice)]
+    values, policy = initial_solution(model, values, policy)
+    starts = model.indptr[:-1]
+    entry_states = np.repeat(np.arange(model.n_states), np.diff(model.indptr))
+    rows = np.arange(model.n_states)
+    delta_max = theta + 1
+    while delta_max >= theta:
+        expected = [values]
+        for level in reversed(range(dice)):
+            expected.insert(0, expected[0][children[level]] @ model.bias)
+        # the only afterstate of a full multiset is sticking, worth the final score
+        expected[dice] = model.final_scores
+        q_values = model.rewards + gamma * np.concatenate(expected)[model.afterstates]
+
+        # same choice as greedy_policy: the first best entry, switching only when strictly better
+        best = np.maximum.reduceat(q_values, starts)
+        first = np.flatnonzero(q_values == best[entry_states])
+        first = first[np.searchsorted(first, starts)]
+        improved = best > 0
+        switch = improved & (best > q_values[model.positions[rows, policy]] + 1e-12 * np.abs(best))
+        new_values = np.where(improved, best, 0.0)
+        policy = np.where(switch, model.actions[first], policy)
+
+        delta_max = np.max(np.abs(new_values - values))
+        values = new_values
+        if monitor is not None and monitor.record(delta_max, len(q_values), afterstates=int(lattice.offsets[dice])):
+            break
+    return values, policy
+
+
+def action_values(model, values, gamma):
+    """Compute the action values of every (state, action) pair with a synchronous Bellman backup.
+
+    Unlike BellmanOperator, every action of a state is valued from the same state values,
+    which is the backup that policy iteration and the in-place solvers build on.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        values (np.ndarray): The current value of each state.
+        gamma (float): The discount factor for future rewards.
+
+    Returns:
+        (np.ndarray): An array of shape (n_states, n_actions) with the action values.
+    """
+    expected = row_sums(model.indptr, model.probabilities * values[model.next_states])
+    future = np.where(model.game_over, np.repeat(model.final_scores, model.n_actions), expected)
+    return (model.rewards + gamma * future).reshape(model.n_states, model.n_actions)
+
+
+def greedy_policy(q_values, values, policy):
+    """Pick the best action of every state, keeping the zero floor and the current action on ties.
+
+    Args:
+        q_values (np.ndarray): The action values of shape (n_states, n_actions).
+        values (np.ndarray): The current value of each state, used where no action is positive.
+        policy (np.ndarray): The current action index of each state.
+
+    Returns:
+        (np.ndarray, np.ndarray): The new state values and the new policy.
+    """
+    rows = np.arange(len(policy))
+    best = q_values.max(axis=1)
+    improved = best > 0
+    # only switch when strictly better, so policy iteration does not cycle between equal actions
+    switch = improved & (best > q_values[rows, policy] + 1e-12 * np.abs(best))
+    return np.where(improved, best, 0.0), np.where(switch, q_values.argmax(axis=1), policy)
+
+
+def value_error_bound(model, values, gamma):
+    """Bound the distance between the given state values and the exact optimal state values of the game.
+
+    With T the exact synchronous backup of action_values and greedy_policy, a contraction of
+    modulus gamma, every v satisfies |v* - v| <= |T v - v| / (1 - gamma) in the max norm.
+    A truncated model lacks at most truncated_mass of the probability of each row, so its
+    backup differs from T v by at most gamma * truncated_mass * max(v) on non-negative values,
+    and |T v - v| is at most that plus the residual of one more backup on the model itself.
+    The bound holds whichever solver produced the values, converged or not.
+
+    Args:
+        model (TransitionModel): The exact or truncated transition model the values were solved on.
+        values (np.ndarray): The value of each state.
+        gamma (float): The discount factor for future rewards, below 1.
+
+    Returns:
+        (float): The largest possible error of any state value.
+    """
+    if not 0 <= gamma < 1:
+        return float("inf")
+    values = np.asarray(values, dtype=float)
+    backup, _ = greedy_policy(action_values(model, values, gamma), values, np.zeros(model.n_states, dtype=np.int64))
+    residual = np.max(np.abs(backup - values), initial=0.0)
+    truncation = gamma * model.truncated_mass * np.max(values, initial=0.0)
+    return float((truncation + residual) / (1 - gamma))
+
+
+def evaluate_policy(model, policy, gamma):
+    """Compute the exact value of a policy by solving its linear Bellman equation.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        policy (np.ndarray): The action index of each state.
+        gamma (float): The discount factor for future rewards.
+
+    Returns:
+        (np.ndarray): The value of each state under the policy.
+    """
+    from scipy.sparse import csr_matrix, identity
+    from scipy.sparse.linalg import spsolve
+
+    rows = np.arange(model.n_states) * model.n_actions + policy
+    transitions, rewards = policy_transitions(model, rows)
+    terminal = model.game_over[rows]
+    rewards = rewards + gamma * np.where(terminal, model.final_scores, 0.0)
+    matrix = identity(model.n_states, format="csr") - gamma * csr_matrix(transitions, shape=(model.n_states,) * 2)
+    return spsolve(matrix.tocsc(), rewards)
+
+
+def policy_transitions(model, rows):
+    """Gather the CSR arrays of the given rows of a transition model.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        rows (np.ndarray): The rows to gather, one per state.
+
+    Returns:
+        ((np.ndarray, np.ndarray, np.ndarray), np.ndarray): The (data, indices, indptr) arrays of
+            the transition matrix restricted to the rows, and the reward of each row.
+    """
+    starts, ends = model.indptr[rows], model.indptr[rows + 1]
+    indptr = np.concatenate(([0], np.cumsum(ends - starts)))
+    entries = np.repeat(starts - indptr[:-1], ends - starts) + np.arange(indptr[-1])
+    return (model.probabilities[entries], model.next_states[entries], indptr), model.rewards[rows]
+
+
+def policy_iteration(model, gamma, theta, values=None, policy=None, monitor=None):
+    """Perform policy iteration, evaluating each policy exactly with a sparse linear solve.
+
+    The first policy is the given one, or else greedy with respect to the given or zero state values.
+    Each iteration evaluates the policy and switches every state to its best action, until no state
+    switches, so starting from the policy of a close game usually needs one or two evaluations.
+    theta is not needed for convergence and is only accepted for a common solver signature.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        gamma (float): The discount factor for future rewards.
+        theta (float): Unused.
+        values (np.ndarray): Optional state values to start from, such as those of a previous solve.
+        policy (np.ndarray): Optional action indices to start from, used with values.
+        monitor (SolverMonitor): Optional monitor recording each sweep, which can also stop the solver early.
+
+    Returns:
+        (np.ndarray, np.ndarray): The value and the action index of each state.
+    """
+    if policy is None:
+        values, policy = initial_solution(model, values, policy)
+        _, policy = greedy_policy(action_values(model, values, gamma), values, policy)
+    previous = initial_solution(model)[0] if values is None else values
+    while True:
+        values = evaluate_policy(model, policy, gamma)
+        _, new_policy = greedy_policy(action_values(model, values, gamma), values, policy)
+        if monitor is not None:
+            stopped = monitor.record(np.max(np.abs(values - previous)), model.n_states * model.n_actions,
+                                     switched=int(np.count_nonzero(new_policy != policy)))
+        if np.array_equal(new_policy, policy) or (monitor is not None and stopped):
+            return values, policy
+        policy, previous = new_policy, values
+
+
+def modified_policy_iteration(model, gamma, theta, evaluation_sweeps=20, values=None, policy=None, monitor=None):
+    """Perform modified policy iteration, evaluating each policy with a few cheap sweeps.
+
+    Each iteration does one greedy backup, which also gives the convergence test of value
+    iteration, then evaluation_sweeps backups of the greedy policy without any maximum.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        gamma (float): The discount factor for future rewards.
+        theta (float): The threshold for the convergence of the algorithm.
+        evaluation_sweeps (int): The number of policy evaluation sweeps per iteration.
+        values (np.ndarray): Optional state values to start from, such as those of a previous solve.
+        policy (np.ndarray): Optional action indices to start from, used with values.
+        monitor (SolverMonitor): Optional monitor recording each sweep, which can also stop the solver early.
+
+    Returns:
+        (np.ndarray, np.ndarray): The value and the action index of each state.
+    """
+    values, policy = initial_solution(model, values, policy)
+    delta_max = theta + 1
+    while delta_max >= theta:
+        new_values, policy = greedy_policy(action_values(model, values, gamma), values, policy)
+        delta_max = np.max(np.abs(new_values - values))
+        values = new_values
+
+        rows = np.arange(model.n_states) * model.n_actions + policy
+        (probabilities, next_states, indptr), rewards = policy_transitions(model, rows)
+        terminal = np.where(model.game_over[rows], model.final_scores, 0.0)
+        for _ in range(evaluation_sweeps):
+            expected = row_sums(indptr, probabilities * values[next_states])
+            values = np.maximum(rewards + gamma * (expected + terminal), 0.0)
+        backups = model.n_states * (model.n_actions + evaluation_sweeps)
+        if monitor is not None and monitor.record(delta_max, backups):
+            break
+    return values, policy
+
+
+def state_action_values(model, values, gamma, state):
+    """Compute the action values of a single state from the current state values.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        values (np.ndarray): The current value of each state.
+        gamma (float): The discount factor for future rewards.
+        state (int): The index of the state.
+
+    Returns:
+        (np.ndarray): The value of each action in the state.
+    """
+    first, last = state * model.n_actions, (state + 1) * model.n_actions
+    offsets = model.indptr[first:last + 1]
+    weighted = model.probabilities[offsets[0]:offsets[-1]] * values[model.next_states[offsets[0]:offsets[-1]]]
+    cumulative = np.concatenate(([0.0], np.cumsum(weighted)))
+    expected = cumulative[offsets[1:] - offsets[0]] - cumulative[offsets[:-1] - offsets[0]]
+    future = np.where(model.game_over[first:last], model.final_scores[state], expected)
+    return model.rewards[first:last] + gamma * future
+
+
+def gauss_seidel_value_iteration(model, gamma, theta, values=None, policy=None, monitor=None):
+    """Perform value iteration with in-place Gauss-Seidel sweeps.
+
+    States are backed up one after another in the order of DiceGame.states, each one using the
+    values already updated in the same sweep, which usually converges in fewer sweeps.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        gamma (float): The discount factor for future rewards.
+        theta (float): The threshold for the convergence of the algorithm.
+        values (np.ndarray): Optional state values to start from, such as those of a previous solve.
+        policy (np.ndarray): Optional action indices to start from, used with values.
+        monitor (SolverMonitor): Optional monitor recording each sweep, which can also stop the solver early.
+
+    Returns:
+        (np.ndarray, np.ndarray): The value and the action index of each state.
+    """
+    values, policy = initial_solution(model, values, policy)
+    delta_max = theta + 1
+    while delta_max >= theta:
+        delta_max = 0
+        for state in range(model.n_states):
+            q_values = state_action_values(model, values, gamma, state)
+            best = q_values.max()
+            new_value = best if best > 0 else 0.0
+            if best > 0:
+                policy[state] = q_values.argmax()
+            delta_max = max(delta_max, abs(new_value - values[state]))
+            values[state] = new_value
+        if monitor is not None and monitor.record(delta_max, model.n_states * model.n_actions):
+            break
+    return values, policy
+
+
+def predecessors(model):
+    """Find, for every state, the states that can reach it and the largest probability of doing so.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+
+    Returns:
+        (np.ndarray, np.ndarray, np.ndarray): CSR arrays (indptr, states, probabilities) where the
+            predecessors of state s are states[indptr[s]:indptr[s + 1]].
+    """
+    rows = np.repeat(np.arange(len(model.indptr) - 1), np.diff(model.indptr))
+    pairs = model.next_states * model.n_states + rows // model.n_actions
+    order = np.lexsort((-model.probabilities, pairs))
+    pairs, first = np.unique(pairs[order], return_index=True)
+    # lexsort puts the largest probability of each pair first
+    probabilities = model.probabilities[order][first]
+    indptr = np.searchsorted(pairs // model.n_states, np.arange(model.n_states + 1))
+    return indptr, pairs % model.n_states, probabilities
+
+
+def prioritized_sweeping(model, gamma, theta, values=None, policy=None, monitor=None):
+    """Perform value iteration backing up states in order of how much their value may still change.
+
+    Every state starts with its Bellman error as priority, so a warm start from the values of a
+    close game only backs up the states whose values actually move. The state with the highest
+    priority is backed up, which resets its priority, and each of its predecessors adds to its
+    priority gamma times the largest probability of reaching it times the change of its value.
+    The changes of all its successors add up, so a priority bounds how much the Bellman error of
+    the state may have grown since its last backup. The algorithm stops when no priority reaches
+    theta, so every Bellman error is below theta as when value iteration stops, then extracts the
+    greedy policy of the values. For the monitor, every n_states backups count as one sweep.
+
+    Args:
+        model (TransitionModel): The transition model of the game.
+        gamma (float): The discount factor for future rewards.
+        theta (float): The threshold for the convergence of the algorithm.
+        values (np.ndarray): Optional state values to start from, such as those of a previous solve.
+        policy (np.ndarray): Optional action indices to start from, used with values.
+        monitor (SolverMonitor): Optional monitor recording each sweep, which can also stop the solver early.
+
+    Returns:
+        (np.ndarray, np.ndarray): The value and the action index of each state.
+    """
+    import heapq
+
+    indptr, sources, reach = predecessors(model)
+    values, policy = initial_solution(model, values, policy)
+
+    initial, _ = greedy_policy(action_values(model, values, gamma), values, policy)
+    priorities = np.abs(initial - values)
+    queue = [(-priority, state) for state, priority in enumerate(priorities) if priority >= theta]
+    heapq.heapify(queue)
+    backups = 0
+    delta_max = 0
+    while queue:
+        priority, state = heapq.heappop(queue)
+        if -priority != priorities[state]:
+            continue
+        priorities[state] = 0
+
+        q_values = state_action_values(model, values, gamma, state)
+        best = q_values.max()
+        new_value = best if best > 0 else 0.0
+        change = abs(new_value - values[state])
+        values[state] = new_value
+        backups += 1
+        delta_max = max(delta_max, change)
+
+        if change > 0:
+            affected = sources[indptr[state]:indptr[state + 1]]
+            priorities[affected] += gamma * reach[indptr[state]:indptr[state + 1]] * change
+            for source in affected[priorities[affected] >= theta]:
+                heapq.heappush(queue, (-priorities[source], source))
+
+        if monitor is not None and (backups == model.n_states or not queue):
+            stopped = monitor.record(delta_max, backups * model.n_actions, queued=len(queue))
+            backups = delta_max = 0
+            if stopped:
+                break
+
+    _, policy = greedy_policy(action_values(model, values, gamma), values, policy)
+    return values, policy
+
+
+SOLVERS = {
+    "vectorized": vectorized_value_iteration,
+    "policy_iteration": policy_iteration,
+    "modified_policy_iteration": modified_policy_iteration,
+    "gauss_seidel": gauss_seidel_value_iteration,
+    "prioritized_sweeping": prioritized_sweeping,
+    "afterstate": afterstate_value_iteration,
+}
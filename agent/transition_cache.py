@@ -0,0 +1,87 @@
+from collections import OrderedDict
+import sys
+
+import numpy as np
+
+
+class TransitionCache:
+    """A bounded cache of DiceGame.get_next_states results, shared by agents.
+
+    Entries are keyed by the fingerprint of the game with the action and the state, so every
+    agent of the same game configuration reuses them, whichever DiceGame instance it plays.
+    When the entries take more than max_bytes, the least recently used ones are evicted.
+    Next states are stored as an array of state ids, so an entry takes a few bytes per outcome.
+    """
+    # bytes of the slot and links of an entry in the ordered dict, on top of the objects it holds
+    ENTRY_OVERHEAD = 100
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        """
+        Parameters:
+            max_bytes (int): The maximum estimated memory held by the entries.
+        """
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.nbytes = 0
+        self._entries = OrderedDict()
+
+    def get_next_states(self, game, action, state):
+        """Get the result of game.get_next_states(action, state), computing it on a miss.
+
+        Args:
+            game (DiceGame): The game.
+            action (tuple): The action to take in the state.
+            state (tuple): The state of the game.
+
+        Returns:
+            (tuple): The next states, game over status, reward and probabilities.
+        """
+        key = (game.fingerprint(), action, state)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._unpack(game, entry)
+
+        self.misses += 1
+        states, game_over, reward, probabilities = game.get_next_states(action, state)
+        # next states are kept as ids, and given back as the game's own state tuples
+        state_ids = None if game_over else game.encode_states(np.array(states)).astype(np.uint32)
+        entry = (state_ids, game_over, reward, np.asarray(probabilities))
+        size = self.ENTRY_OVERHEAD + sum(sys.getsizeof(item) for item in (key, entry) + entry)
+        self._entries[key] = entry + (size,)
+        self.nbytes += size
+        while self.nbytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self.nbytes -= evicted[-1]
+            self.evictions += 1
+        return self._unpack(game, entry)
+
+    def info(self):
+        """Report the use and the size of the cache.
+
+        Returns:
+            (dict): The number of hits, misses and evictions, the number of entries and the
+                estimated memory they hold in bytes.
+        """
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions, entries=len(self._entries),
+                    nbytes=self.nbytes)
+
+    def clear(self):
+        """Remove every entry and reset the statistics."""
+        self._entries.clear()
+        self.nbytes = self.hits = self.misses = self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @staticmethod
+    def _unpack(game, entry):
+        state_ids, game_over, reward, probabilities = entry[:4]
+        states = [None] if state_ids is None else [game.states[i] for i in state_ids.tolist()]
+        return states, game_over, reward, probabilities
+
+
+# the cache of every agent that is not given its own
+shared_cache = TransitionCache()
@@ -0,0 +1,159 @@
+import argparse
+import json
+import platform
+import sys
+import time
+
+import numpy as np
+
+from agent.dice_game_agent import MyAgent, play_game_with_agent, play_games_with_agent
+from agent.transition_cache import TransitionCache
+from dice_game import DiceGame
+
+
+DEFAULT_SIZES = ((2, 3), (3, 6), (4, 6))
+DEFAULT_SOLVERS = ("value_iteration", "vectorized")
+
+
+def measure(function, repeat):
+    """
+    Time a function over several runs, after one untimed run
+    The untimed run pays the one-time costs of the process, such as the lazy imports of the
+    solvers, so they do not land on whichever benchmark happens to run first.
+    :param function: Function without arguments to time
+    :param repeat: Number of timed runs
+    :return: Dictionary with the median, minimum and maximum wall-clock time of a run, in seconds
+    """
+    function()
+    times = []
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start_time)
+    return {"median": float(np.median(times)), "min": min(times), "max": max(times), "repeat": repeat}
+
+
+def benchmark_size(dice, sides, solvers=DEFAULT_SOLVERS, repeat=5, games=200, batch_games=100000, seed=0):
+    """
+    Run every benchmark for one game size
+    :param dice: Number of dice of the game
+    :param sides: Number of sides of each die
+    :param solvers: Names of the MyAgent solvers to time
+    :param repeat: Number of runs of each benchmark
+    :param games: Number of games played one by one in each run of the play benchmarks
+    :param batch_games: Number of games of each run of the batch simulation benchmark
+    :param seed: Seed of the random draws
+    :return: Dictionary of timings keyed by benchmark name
+    """
+    size = f"{dice}x{sides}"
+    results = {}
+    results[f"init/{size}"] = measure(lambda: DiceGame(dice=dice, sides=sides), repeat)
+
+    game = DiceGame(dice=dice, sides=sides)
+    # a fixed sample of (action, state) pairs, the same in every run
+    rng = np.random.default_rng(seed)
+    pairs = [(game.actions[a], game.states[s]) for a, s in
+             zip(rng.integers(len(game.actions), size=200), rng.integers(len(game.states), size=200))]
+    results[f"get_next_states/{size}"] = measure(
+        lambda: [game.get_next_states(action, state) for action, state in pairs], repeat)
+    results[f"transition_model/{size}"] = measure(game._build_transition_model, repeat)
+
+    for solver in solvers:
+        # every run starts cold: a new game builds its transition model and a new cache starts empty
+        results[f"agent/{solver}/{size}"] = measure(
+            lambda: MyAgent(DiceGame(dice=dice, sides=sides), solver=solver, transition_cache=TransitionCache()),
+            repeat)
+
+    agent = MyAgent(game, solver=solvers[-1])
+    np.random.seed(seed)
+    results[f"play_game/{size}"] = measure(lambda: [play_game_with_agent(agent, game) for _ in range(games)], repeat)
+    fast_game = DiceGame(dice=dice, sides=sides, fast=True, seed=seed)
+    results[f"play_game_fast/{size}"] = measure(
+        lambda: [play_game_with_agent(agent, fast_game) for _ in range(games)], repeat)
+    results[f"simulate/{size}"] = measure(lambda: play_games_with_agent(agent, game, batch_games, seed=seed), repeat)
+    return results
+
+
+def run_benchmarks(sizes=DEFAULT_SIZES, solvers=DEFAULT_SOLVERS, repeat=5, games=200, batch_games=100000, seed=0):
+    """
+    Run every benchmark over a matrix of game sizes
+    :param sizes: Sequence of (dice, sides) tuples
+    :return: Dictionary with the environment of the run and the timings keyed by benchmark name
+    """
+    results = {}
+    for dice, sides in sizes:
+        print(f"benchmarking {dice} dice with {sides} sides", file=sys.stderr)
+        results.update(benchmark_size(dice, sides, solvers, repeat, games, batch_games, seed))
+    environment = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        # the agent benchmarks start each run with a new game and an empty transition cache, in a
+        # process already warmed up by an untimed run: a cold cache, not a cold process
+        "agent_start": "cold cache, warm process",
+    }
+    return {"environment": environment, "results": results}
+
+
+def compare(current, baseline, tolerance=0.2):
+    """
+    Compare the median timings of a run against a baseline run
+    :param current: Results of run_benchmarks
+    :param baseline: Results of run_benchmarks to compare against
+    :param tolerance: Relative slowdown above which a benchmark is a regression
+    :return: List of (name, baseline median, current median, ratio, regressed) tuples for the shared benchmarks
+    """
+    comparisons = []
+    for name, timing in current["results"].items():
+        if name not in baseline["results"]:
+            continue
+        before = baseline["results"][name]["median"]
+        ratio = timing["median"] / before if before > 0 else float("inf")
+        comparisons.append((name, before, timing["median"], ratio, ratio > 1 + tolerance))
+    return comparisons
+
+
+def parse_size(text):
+    dice, sides = text.lower().split("x")
+    return int(dice), int(sides)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the game, the solvers and the simulators over game sizes.")
+    parser.add_argument("--sizes", nargs="+", type=parse_size, default=list(DEFAULT_SIZES),
+                        help="game sizes as DICExSIDES, e.g. 3x6 5x6")
+    parser.add_argument("--solvers", nargs="+", choices=MyAgent.SOLVERS, default=list(DEFAULT_SOLVERS))
+    parser.add_argument("--repeat", type=int, default=5, help="runs of each benchmark")
+    parser.add_argument("--games", type=int, default=200, help="games per run of the play benchmarks")
+    parser.add_argument("--batch-games", type=int, default=100000, help="games per run of the batch simulation")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="compare against the results in this JSON file")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative slowdown of the median flagged as a regression")
+    args = parser.parse_args(argv)
+
+    current = run_benchmarks(args.sizes, args.solvers, args.repeat, args.games, args.batch_games, args.seed)
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(current, file, indent=2)
+
+    if args.baseline is None:
+        for name, timing in current["results"].items():
+            print(f"{name:40s} {timing['median']:12.6f}s")
+        return 0
+
+    with open(args.baseline) as file:
+        baseline = json.load(file)
+    regressions = 0
+    for name, before, after, ratio, regressed in compare(current, baseline, args.tolerance):
+        flag = "REGRESSION" if regressed else ""
+        print(f"{name:40s} {before:12.6f}s {after:12.6f}s {ratio:7.2f}x {flag}")
+        regressions += regressed
+    print(f"{regressions} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,197 @@
+from statistics import NormalDist
+
+import numpy as np
+
+from agent.dice_game_agent import DiceGameAgent, play_games_with_agent
+from agent.solvers import policy_transitions
+
+
+class Evaluation:
+    """Running mean and confidence interval of the scores of an agent.
+
+    Scores are added in batches, merging the mean and the sum of squared deviations of each
+    batch into the running ones, so no score has to be kept. The interval is the normal
+    approximation of the mean, mean +/- z * std / sqrt(games).
+    """
+    def __init__(self, confidence=0.95):
+        """
+        Parameters:
+            confidence (float): The confidence level of the interval.
+        """
+        self.confidence = confidence
+        self.games = 0
+        self.mean = 0.0
+        self.squared_deviations = 0.0
+        # why the evaluation stopped, see evaluate_sequentially
+        self.reason = None
+        self._z = NormalDist().inv_cdf((1 + confidence) / 2)
+
+    def update(self, scores):
+        """Add a batch of scores.
+
+        Args:
+            scores (np.ndarray): The scores of the games of the batch.
+        """
+        scores = np.asarray(scores, dtype=float)
+        if scores.size == 0:
+            return
+        games = self.games + scores.size
+        batch_mean = scores.mean()
+        delta = batch_mean - self.mean
+        self.squared_deviations += np.sum((scores - batch_mean) ** 2) + delta ** 2 * self.games * scores.size / games
+        self.mean += delta * scores.size / games
+        self.games = games
+
+    @property
+    def std(self):
+        """The sample standard deviation of the scores."""
+        if self.games < 2:
+            return float("inf")
+        return float(np.sqrt(self.squared_deviations / (self.games - 1)))
+
+    @property
+    def half_width(self):
+        """Half the width of the confidence interval of the mean."""
+        if self.games < 2:
+            return float("inf")
+        return self._z * self.std / np.sqrt(self.games)
+
+    @property
+    def lower(self):
+        """The lower bound of the confidence interval of the mean."""
+        return self.mean - self.half_width
+
+    @property
+    def upper(self):
+        """The upper bound of the confidence interval of the mean."""
+        return self.mean + self.half_width
+
+    def __repr__(self):
+        return (f"Evaluation(mean={self.mean:.4f}, half_width={self.half_width:.4f}, "
+                f"games={self.games}, reason={self.reason!r})")
+
+
+def evaluate_sequentially(agent, game, precision=0.05, confidence=0.95, batch_size=1000, max_games=100000,
+                          best=None, seed=None):
+    """Play games with an agent in batches until its mean score is known well enough.
+
+    After each batch the evaluation stops if the half width of the confidence interval is
+    at most precision ("precision"), if the interval lies entirely below the interval of
+    best ("worse"), or once max_games games were played ("max_games").
+
+    Args:
+        agent (DiceGameAgent): The agent to evaluate.
+        game (DiceGame): The game to play.
+        precision (float): The target half width of the confidence interval.
+        confidence (float): The confidence level of the interval.
+        batch_size (int): The number of games played between two checks.
+        max_games (int): The largest number of games to play.
+        best (Evaluation): The evaluation of the best agent so far, if any.
+        seed (int): Seed or numpy Generator for the random draws.
+
+    Returns:
+        (Evaluation): The evaluation, with the number of games it used and why it stopped.
+    """
+    rng = np.random.default_rng(seed)
+    evaluation = Evaluation(confidence)
+    while True:
+        games = min(batch_size, max_games - evaluation.games)
+        scores, _ = play_games_with_agent(agent, game, games, seed=rng)
+        evaluation.update(scores)
+        if evaluation.half_width <= precision:
+            evaluation.reason = "precision"
+        elif best is not None and evaluation.upper < best.lower:
+            evaluation.reason = "worse"
+        elif evaluation.games >= max_games:
+            evaluation.reason = "max_games"
+        else:
+            continue
+        return evaluation
+
+
+def race(agents, game, precision=0.05, confidence=0.95, batch_size=1000, max_games=100000, seed=None):
+    """Evaluate agents one after another, dropping each one as soon as it is shown worse than the best so far.
+
+    Each agent plays on its own random stream spawned from seed, so its games do not depend
+    on the other agents.
+
+    Args:
+        agents (list): The agents to evaluate.
+        game (DiceGame): The game to play.
+        precision (float): The target half width of the confidence interval of each agent.
+        confidence (float): The confidence level of the intervals.
+        batch_size (int): The number of games played between two checks.
+        max_games (int): The largest number of games to play per agent.
+        seed (int): Seed of the random streams, None for fresh entropy.
+
+    Returns:
+        (list): The Evaluation of each agent, in the order of agents.
+    """
+    streams = np.random.SeedSequence(seed).spawn(len(agents))
+    best = None
+    evaluations = []
+    for agent, stream in zip(agents, streams):
+        evaluation = evaluate_sequentially(agent, game, precision, confidence, batch_size, max_games,
+                                           best=best, seed=np.random.default_rng(stream))
+        if evaluation.reason != "worse" and (best is None or evaluation.mean > best.mean):
+            best = evaluation
+        evaluations.append(evaluation)
+    return evaluations
+
+
+def expected_score(game, policy):
+    """Compute the exact expected final score and number of rerolls of a policy, without simulation.
+
+    The policy makes the game a Markov chain over DiceGame.states, absorbed when it sticks.
+    With P the transitions of the states that reroll and r the reward of each state's action,
+    the expected score from each state solves (I - P) v = r and the expected rerolls solve
+    (I - P) n = 1 on the rerolling states, and the game starts from the distribution of a
+    roll of every die.
+
+    Args:
+        game (DiceGame): The game.
+        policy: A DiceGameAgent, a dict mapping each state to its action, or an array with the
+            action id of each state id.
+
+    Returns:
+        (float, float): The expected score of a game, as in DiceGame.score and simulate, and the
+            expected number of rerolls after the first roll.
+    """
+    from scipy.sparse import csr_matrix, identity
+    from scipy.sparse.linalg import spsolve
+
+    if isinstance(policy, DiceGameAgent):
+        policy = policy.play_many(game.states)
+    elif isinstance(policy, dict):
+        policy = [game.get_action_id(policy[state]) for state in game.states]
+    policy = np.asarray(policy, dtype=np.int64)
+
+    model = game.get_transition_model()
+    rows = np.arange(model.n_states) * model.n_actions + policy
+    (probabilities, next_states, indptr), rewards = policy_transitions(model, rows)
+    transitions = csr_matrix((probabilities, next_states, indptr), shape=(model.n_states,) * 2)
+    start, _, _, start_probabilities = model.get_next_states(game.get_action_id(()), 0)
+    initial = np.zeros(model.n_states)
+    initial[start] = start_probabilities
+
+    # every state the game can reach must be able to reach a state that sticks, or the game may never end
+    reached = initial > 0
+    while True:
+        grown = reached | (transitions.T @ reached > 0)
+        if np.array_equal(grown, reached):
+            break
+        reached = grown
+    ending = model.game_over[rows]
+    while True:
+        grown = ending | (transitions @ ending > 0)
+        if np.array_equal(grown, ending):
+            break
+        ending = grown
+    if np.any(reached & ~ending):
+        raise ValueError("policy must end the game from every state it can reach")
+
+    states = np.flatnonzero(reached)
+    matrix = (identity(len(states), format="csr") - transitions[states][:, states]).tocsc()
+    values = spsolve(matrix, rewards[states])
+    rolls = spsolve(matrix, (~model.game_over[rows][states]).astype(float))
+    return float(initial[states] @ values), float(initial[states] @ rolls)
@@ -1,51 +1,240 @@
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import time
-import random
 
 import numpy as np
-import matplotlib.pyplot as plt
 
-from agent.dice_game_agent import MyAgent, play_game_with_agent
-from dice_game import DiceGame
+from agent.dice_game_agent import MyAgent, play_game_with_agent, play_games_with_agent
+from analysis.evaluation import Evaluation, expected_score, race
+from analysis.results import ResultsFile
+from dice_game import DiceGame, TransitionModel
 
 
-def play_with_agent(game, theta, gamma):
-    test_agent = MyAgent(game, theta=theta, gamma=gamma)
+_worker_game = None
+_worker_blocks = []
+
+
+def evaluate_configuration(game, theta, gamma, games_sample, seed, solver="value_iteration"):
+    """
+    Solve the game for a (theta, gamma) configuration and play it with its own random stream
+    :param games_sample: Number of games to play with the agent, None for the exact expected score
+    :param seed: Seed of the random stream used to play the games
+    :param solver: Name of the solver used by MyAgent
+    :return: Tuple of average score, agent construction time and total play time
+    """
     start_time = time.process_time()
-    score = play_game_with_agent(test_agent, game)
-    execution_time = time.process_time() - start_time
-    return score, execution_time
+    test_agent = MyAgent(game, theta=theta, gamma=gamma, solver=solver)
+    solve_time = time.process_time() - start_time
 
+    score, play_time = evaluate_agent(test_agent, game, games_sample, seed)
+    return score, solve_time, play_time
 
-def run_simulation(game, theta=None, gamma=None, theta_range=(0.1, 50), gamma_range=(0.001, 1.0), num_iterations=1000):
+
+def evaluate_agent(agent, game, games_sample, seed):
+    """
+    Play an already solved agent with its own random stream
+    :param games_sample: Number of games to play with the agent, None to compute the exact expected
+                         score of its policy instead, see expected_score
+    :param seed: Seed of the random stream used to play the games
+    :return: Tuple of average score and total play time
+    """
+    if games_sample is None:
+        start_time = time.process_time()
+        score, _ = expected_score(game, agent)
+        return score, time.process_time() - start_time
+
+    np.random.seed(seed)
+
+    total_score = 0
+    play_time = 0
+    for _ in range(games_sample):
+        start_time = time.process_time()
+        total_score += play_game_with_agent(agent, game)
+        play_time += time.process_time() - start_time
+
+    return total_score / games_sample, play_time
+
+
+def configuration_seeds(seed, count):
+    """
+    Spawn one independent random stream per configuration from a single seed
+    :param seed: Seed of the random streams, None for fresh entropy
+    :param count: Number of configurations
+    :return: List of integer seeds
+    """
+    return [int(stream.generate_state(1)[0]) for stream in np.random.SeedSequence(seed).spawn(count)]
+
+
+def evaluate_configurations(game, thetas, gammas, games_sample, seed=None, solver="value_iteration", n_workers=1,
+                            seeds=None):
+    """
+    Evaluate (theta, gamma) configurations, optionally spread over a pool of processes.
+    Each configuration gets its own random stream spawned from the seed, so the scores
+    do not depend on the number of workers nor on the order the configurations run in.
+    With more than one worker and a solver working on the transition model, the model is built
+    once and shared read-only with the workers through shared memory. The default
+    "value_iteration" solver never reads the model, so it is neither built nor shared then,
+    and each worker generates the transitions it needs through its own transition cache.
+    :param thetas: Sequence of theta values, one per configuration
+    :param gammas: Sequence of gamma values, one per configuration
+    :param games_sample: Number of games to play per configuration, None for the exact expected scores
+    :param seed: Seed of the random streams, None for fresh entropy
+    :param n_workers: Number of worker processes, 1 to run in this process
+    :param seeds: Seed of each configuration, spawned from seed if None
+    :return: List of (average score, solve time, play time) tuples, one per configuration
+    """
+    if seeds is None:
+        seeds = configuration_seeds(seed, len(thetas))
+    arguments = (thetas, gammas, [games_sample] * len(thetas), seeds, [solver] * len(thetas))
+
+    if n_workers <= 1:
+        return [evaluate_configuration(game, *configuration) for configuration in zip(*arguments)]
+
+    blocks, layout = [], None
+    if solver != "value_iteration":
+        blocks, layout = _share_transition_model(game.get_transition_model())
+    try:
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_worker,
+                                 initargs=(game, layout, len(game.actions))) as executor:
+            return list(executor.map(_evaluate_in_worker, *arguments, chunksize=max(1, len(thetas) // (4 * n_workers))))
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+
+def stream_configurations(game, thetas, gammas, games_sample, results_path, seed=None, solver="value_iteration",
+                          n_workers=1, chunk_size=100):
+    """
+    Evaluate configurations in chunks, appending each finished chunk to a results file.
+    Configurations already in the file are skipped, so a search that crashed resumes from its
+    last completed chunk when it is run again with the same configurations and seed.
+    Resuming with other configurations raises a ValueError instead of mixing up their results.
+    :param results_path: Path of the CSV results file, see ResultsFile
+    :param chunk_size: Number of configurations evaluated between two writes
+    :return: Dict of the columns of the results file, including earlier runs, sorted by configuration index
+    """
+    results = ResultsFile(results_path)
+    stored = results.read()
+    indices = stored["index"]
+    if np.any(indices >= len(thetas)) or not (np.allclose(stored["theta"], np.take(thetas, indices), rtol=1e-12)
+                                             and np.allclose(stored["gamma"], np.take(gammas, indices), rtol=1e-12)):
+        raise ValueError(f"{results_path} holds other configurations, resume with the same configurations and seed")
+    completed = set(indices.tolist())
+    seeds = configuration_seeds(seed, len(thetas))
+    pending = [index for index in range(len(thetas)) if index not in completed]
+    for start in range(0, len(pending), chunk_size):
+        chunk = pending[start:start + chunk_size]
+        scores = evaluate_configurations(game, [thetas[i] for i in chunk], [gammas[i] for i in chunk], games_sample,
+                                         solver=solver, n_workers=n_workers, seeds=[seeds[i] for i in chunk])
+        results.append([(index, thetas[index], gammas[index], *score) for index, score in zip(chunk, scores)])
+    return results.read()
+
+
+def race_configurations(game, thetas, gammas, precision, seed=None, solver="value_iteration"):
+    """
+    Evaluate (theta, gamma) configurations with sequential Monte Carlo instead of a fixed number of games.
+    Each configuration plays batches of games until its mean score is known within precision,
+    or until it is shown to be worse than the best configuration evaluated before it.
+    :param thetas: Sequence of theta values, one per configuration
+    :param gammas: Sequence of gamma values, one per configuration
+    :param precision: Target half width of the 95% confidence interval of each mean score
+    :param seed: Seed of the random streams, None for fresh entropy
+    :return: List of (Evaluation, solve time, play time) tuples, one per configuration
+    """
+    agents = []
+    solve_times = []
+    for theta, gamma in zip(thetas, gammas):
+        start_time = time.process_time()
+        agents.append(MyAgent(game, theta=theta, gamma=gamma, solver=solver))
+        solve_times.append(time.process_time() - start_time)
+
+    start_time = time.process_time()
+    evaluations = race(agents, game, precision=precision, seed=seed)
+    play_time = time.process_time() - start_time
+    total_games = sum(evaluation.games for evaluation in evaluations)
+    print(f"played {total_games} games over {len(agents)} configurations")
+
+    # the games of all configurations are timed together, so play time is shared in proportion to the games
+    return [(evaluation, solve_time, play_time * evaluation.games / total_games)
+            for evaluation, solve_time in zip(evaluations, solve_times)]
+
+
+def _share_transition_model(model):
+    blocks = []
+    layout = {}
+    for name in TransitionModel.ARRAYS:
+        array = getattr(model, name)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+        blocks.append(block)
+        layout[name] = (block.name, array.shape, array.dtype.str)
+    return blocks, layout
+
+
+def _init_worker(game, layout, n_actions):
+    global _worker_game
+    _worker_game = game
+    if layout is None:
+        return
+    arrays = {}
+    for name, (block_name, shape, dtype) in layout.items():
+        # keep a reference to the block for as long as the worker uses the array mapped on it
+        block = shared_memory.SharedMemory(name=block_name)
+        _worker_blocks.append(block)
+        arrays[name] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        arrays[name].flags.writeable = False
+    game.set_transition_model(TransitionModel(n_actions=n_actions, **arrays))
+
+
+def _evaluate_in_worker(theta, gamma, games_sample, seed, solver):
+    return evaluate_configuration(_worker_game, theta, gamma, games_sample, seed, solver)
+
+
+def run_simulation(game, theta=None, gamma=None, theta_range=(0.1, 50), gamma_range=(0.001, 1.0), num_iterations=1000,
+                   seed=None, solver="value_iteration", n_workers=1, precision=None, results_path=None):
     """
     Perform a random search for the optimal values of theta and gamma
+    :param theta: Fixed value for theta, sampled in every iteration if None
+    :param gamma: Fixed value for gamma, sampled in every iteration if None
     :param num_iterations: Number of iterations to perform the search
     :param theta_range: Tuple of range for theta (min, max)
     :param gamma_range: Tuple of range for gamma (min, max)
+    :param seed: Seed of the search, None for fresh entropy
+    :param solver: Name of the solver used by MyAgent
+    :param n_workers: Number of worker processes evaluating the configurations
+    :param precision: If given, judge each configuration by a sequential evaluation to this precision
+                      instead of a single game, see race_configurations
+    :param results_path: If given, stream the results to this CSV file and resume from it, see
+                         stream_configurations, which needs a seed unless theta and gamma are fixed;
+                         ignored with precision
     :return: Tuple of optimal theta and gamma values
     """
+    sampler = np.random.default_rng(seed)
+    theta_values = [theta if theta is not None else sampler.uniform(*theta_range) for _ in range(num_iterations)]
+    gamma_values = [gamma if gamma is not None else sampler.uniform(*gamma_range) for _ in range(num_iterations)]
+
+    if precision is None and results_path is not None:
+        columns = stream_configurations(game, theta_values, gamma_values, 1, results_path, seed=seed, solver=solver,
+                                        n_workers=n_workers)
+        # the rows of the file, in index order, are the configurations of the search
+        theta_values, gamma_values = list(columns["theta"]), list(columns["gamma"])
+        results = list(zip(columns["score"], columns["solve_time"], columns["play_time"]))
+    elif precision is None:
+        results = evaluate_configurations(game, theta_values, gamma_values, 1, seed=seed, solver=solver,
+                                          n_workers=n_workers)
+    else:
+        results = [(evaluation.mean, solve_time, play_time) for evaluation, solve_time, play_time
+                   in race_configurations(game, theta_values, gamma_values, precision, seed=seed, solver=solver)]
+    scores = [score for score, _, _ in results]
+    # as when each configuration was timed from building its agent to the end of its game
+    execution_times = [solve_time + play_time for _, solve_time, play_time in results]
+
     best_score = float('-inf')
     best_theta = None
     best_gamma = None
     best_execution_time = float('inf')
-
-    theta_values = []
-    gamma_values = []
-    scores = []
-    execution_times = []
-
-    for i in range(num_iterations):
-        if not theta and not gamma:
-            theta = random.uniform(theta_range[0], theta_range[1])
-            gamma = random.uniform(gamma_range[0], gamma_range[1])
-
-        score, execution_time = play_with_agent(game, theta, gamma)
-
-        theta_values.append(theta)
-        gamma_values.append(gamma)
-        scores.append(score)
-        execution_times.append(execution_time)
-
+    for theta, gamma, score, execution_time in zip(theta_values, gamma_values, scores, execution_times):
         if score > best_score and execution_time < best_execution_time:
             best_execution_time = execution_time
             best_theta, best_gamma, best_score = theta, gamma, score
@@ -54,8 +243,111 @@ def run_simulation(game, theta=None, gamma=None, theta_range=(0.1, 50), gamma_ra
     return theta_values, gamma_values, scores, execution_times
 
 
+def run_successive_halving(game, n_configurations=81, eta=3, min_games=100, max_games=30000,
+                           theta_range=(0.001, 50), gamma_range=(0.5, 1.0), objective="score", time_weight=0.0,
+                           timing_repeat=3, seed=None, solver="value_iteration"):
+    """
+    Search theta and gamma by successive halving over game budgets instead of a fixed number of games each.
+    Every sampled configuration is solved once and plays min_games games. Then only the best 1/eta
+    of them go on to the next rung, where each survivor plays until it has eta times more games,
+    continuing its own random stream, until at most eta configurations are left or max_games is reached.
+    By default the search is score first: the rungs keep the configurations with the best mean score,
+    and the final survivors play one more rung of games, after which those whose confidence interval
+    overlaps the best one's are taken as tied, the fastest to solve winning. Their solve time is the
+    least of timing_repeat more solves, as a single sample is mostly timer noise. With
+    objective="weighted" configurations are ranked by their mean score minus time_weight times their
+    solve time instead, so time_weight trades score points for seconds of solving.
+    :param n_configurations: Number of (theta, gamma) configurations sampled, each solved once
+    :param eta: Factor by which the survivors shrink and the game budget grows at each rung
+    :param min_games: Number of games played by every configuration in the first rung
+    :param max_games: Largest number of games played by a configuration
+    :param theta_range: Tuple of range for theta (min, max), sampled log-uniformly
+    :param gamma_range: Tuple of range for gamma (min, max), sampled uniformly
+    :param objective: "score" or "weighted", how configurations are ranked
+    :param time_weight: Score points one second of solve time is worth, with objective="weighted"
+    :param timing_repeat: Number of solves timed again for each tied final configuration, with objective="score"
+    :param seed: Seed of the search, None for fresh entropy
+    :param solver: Name of the solver used by MyAgent
+    :return: Tuple of the best theta, gamma, Evaluation of its score and solve time, and a list with
+             the (theta, gamma, Evaluation, solve time) of every configuration
+    """
+    if objective not in ("score", "weighted"):
+        raise ValueError('objective must be "score" or "weighted"')
+
+    def rank(i):
+        if objective == "score":
+            return evaluations[i].mean
+        return evaluations[i].mean - time_weight * solve_times[i]
+
+    def solve(theta, gamma):
+        start_time = time.process_time()
+        agent = MyAgent(game, theta=theta, gamma=gamma, solver=solver)
+        return agent, time.process_time() - start_time
+
+    sampler = np.random.default_rng(seed)
+    thetas = np.exp(sampler.uniform(*np.log(theta_range), size=n_configurations))
+    gammas = sampler.uniform(*gamma_range, size=n_configurations)
+    streams = [np.random.default_rng(stream) for stream in np.random.SeedSequence(seed).spawn(n_configurations)]
+
+    agents = []
+    solve_times = []
+    for theta, gamma in zip(thetas, gammas):
+        agent, solve_time = solve(theta, gamma)
+        agents.append(agent)
+        solve_times.append(solve_time)
+    evaluations = [Evaluation() for _ in range(n_configurations)]
+
+    survivors = list(range(n_configurations))
+    budget = min_games
+    while True:
+        for i in survivors:
+            scores, _ = play_games_with_agent(agents[i], game, budget - evaluations[i].games, seed=streams[i])
+            evaluations[i].update(scores)
+        survivors.sort(key=rank, reverse=True)
+        if len(survivors) <= eta or budget >= max_games:
+            break
+        survivors = survivors[:max(1, len(survivors) // eta)]
+        budget = min(budget * eta, max_games)
+
+    best = survivors[0]
+    if objective == "score":
+        # one more rung of games without halving, so the final survivors are only tied when their scores are close
+        budget = min(budget * eta, max_games)
+        for i in survivors:
+            scores, _ = play_games_with_agent(agents[i], game, budget - evaluations[i].games, seed=streams[i])
+            evaluations[i].update(scores)
+        survivors.sort(key=rank, reverse=True)
+        best = survivors[0]
+        tied = [i for i in survivors if evaluations[i].upper >= evaluations[best].lower]
+        for i in tied:
+            solve_times[i] = min([solve_times[i]] + [solve(thetas[i], gammas[i])[1] for _ in range(timing_repeat)])
+        best = min(tied, key=lambda i: solve_times[i])
+    total_games = sum(evaluation.games for evaluation in evaluations)
+    print(f"best_theta={thetas[best]}, best_gamma={gammas[best]}, best_score={evaluations[best].mean}, "
+          f"solve_time={solve_times[best]}, agents={n_configurations}, games={total_games}")
+    history = list(zip(thetas, gammas, evaluations, solve_times))
+    return thetas[best], gammas[best], evaluations[best], solve_times[best], history
+
+
+def plot_results_file(results_path, chunk_size=10000):
+    """
+    Plot the results streamed to a file by a search, as a separate step from the search itself
+    :param results_path: Path of the CSV results file, read a chunk of rows at a time
+    """
+    theta_values, gamma_values, scores, execution_times = [], [], [], []
+    for chunk in ResultsFile(results_path).iter_chunks(chunk_size):
+        theta_values.extend(chunk["theta"])
+        gamma_values.extend(chunk["gamma"])
+        scores.extend(chunk["score"])
+        execution_times.extend(chunk["solve_time"] + chunk["play_time"])
+    plot_results(theta_values, gamma_values, scores, execution_times)
+
+
 def plot_results(theta_values, gamma_values, scores, execution_times):
     """Plot the results of the game in a graph and table format"""
+    # imported here so the processes running the search never load matplotlib
+    import matplotlib.pyplot as plt
+
     # calculate average
     average_score = np.mean(scores)
     average_theta = np.mean(theta_values)
@@ -107,6 +399,8 @@ def plot_results(theta_values, gamma_values, scores, execution_times):
 
 
 def plot_linear_results_for_theta(theta_values, scores, execution_times):
+    import matplotlib.pyplot as plt
+
     plt.plot(theta_values, scores)
     plt.xlabel('Theta')
     plt.ylabel('Score')
@@ -123,6 +417,8 @@ def plot_linear_results_for_theta(theta_values, scores, execution_times):
 
 
 def plot_linear_results_for_gamma(gamma_values, scores, execution_times):
+    import matplotlib.pyplot as plt
+
     plt.plot(gamma_values, scores)
     plt.xlabel('Gamma')
     plt.ylabel('Score')
@@ -149,62 +445,50 @@ def run_simulations():
     plot_results(theta_values, gamma_values, scores, execution_times)
 
 
-def run_fine_tune_theta(game, theta_candidates, gamma_candidates):
-    scores = []
-    execution_times = []
-    games_sample = 1000
-
-    average_gamma = [np.mean(gamma_candidates)]
-
-    for gamma in average_gamma:
-        for theta in theta_candidates:
-            total_score = 0
-            total_time = 0
-
-            game.reset()
-
-            start_time = time.process_time()
-            test_agent = MyAgent(game, theta=theta, gamma=gamma)
-            total_time += time.process_time() - start_time
+def run_fine_tune_theta(game, theta_candidates, gamma_candidates, seed=None, solver="value_iteration", n_workers=1,
+                        precision=None, exact=False):
+    games_sample = None if exact else 1000
 
-            for _ in range(games_sample):
-                start_time = time.process_time()
-                score = play_game_with_agent(test_agent, game)
-                total_time += time.process_time() - start_time
-                total_score += score
+    average_gamma = np.mean(gamma_candidates)
+    gammas = [average_gamma] * len(theta_candidates)
 
-            scores.append(total_score / games_sample)
-            execution_times.append(total_time)
+    if precision is None:
+        results = evaluate_configurations(game, list(theta_candidates), gammas, games_sample, seed=seed,
+                                          solver=solver, n_workers=n_workers)
+    else:
+        results = [(evaluation.mean, solve_time, play_time) for evaluation, solve_time, play_time
+                   in race_configurations(game, list(theta_candidates), gammas, precision, seed=seed, solver=solver)]
+    scores = [score for score, _, _ in results]
+    execution_times = [solve_time + play_time for _, solve_time, play_time in results]
 
     plot_linear_results_for_theta(theta_candidates, scores, execution_times)
 
 
-def run_fine_tune_gamma(game, theta_candidates, gamma_candidates):
-    scores = []
-    execution_times = []
-    games_sample = 1000
-
-    average_theta = [np.mean(theta_candidates)]
-
-    for gamma in gamma_candidates:
-        for theta in average_theta:
-            total_score = 0
-            total_time = 0
-
-            game.reset()
-
-            start_time = time.process_time()
-            test_agent = MyAgent(game, theta=theta, gamma=gamma)
-            total_time += time.process_time() - start_time
-
-            for _ in range(games_sample):
-                start_time = time.process_time()
-                score = play_game_with_agent(test_agent, game)
-                total_time += time.process_time() - start_time
-                total_score += score
-
-            scores.append(total_score / games_sample)
-            execution_times.append(total_time)
+def run_fine_tune_gamma(game, theta_candidates, gamma_candidates, seed=None, solver="value_iteration", n_workers=1,
+                        batch_gammas=False, precision=None, exact=False):
+    games_sample = None if exact else 1000
+
+    average_theta = np.mean(theta_candidates)
+    thetas = [average_theta] * len(gamma_candidates)
+
+    if batch_gammas:
+        # solve the whole grid in one pass, same agents as the "vectorized" solver
+        start_time = time.process_time()
+        agents = MyAgent.for_gammas(game, list(gamma_candidates), theta=average_theta)
+        solve_time = (time.process_time() - start_time) / len(agents)
+        seeds = configuration_seeds(seed, len(agents))
+        results = []
+        for agent, agent_seed in zip(agents, seeds):
+            score, play_time = evaluate_agent(agent, game, games_sample, agent_seed)
+            results.append((score, solve_time, play_time))
+    elif precision is not None:
+        results = [(evaluation.mean, solve_time, play_time) for evaluation, solve_time, play_time
+                   in race_configurations(game, thetas, list(gamma_candidates), precision, seed=seed, solver=solver)]
+    else:
+        results = evaluate_configurations(game, thetas, list(gamma_candidates), games_sample, seed=seed,
+                                          solver=solver, n_workers=n_workers)
+    scores = [score for score, _, _ in results]
+    execution_times = [solve_time + play_time for _, solve_time, play_time in results]
 
     plot_linear_results_for_gamma(gamma_candidates, scores, execution_times)
 
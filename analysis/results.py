@@ -0,0 +1,108 @@
+import csv
+import os
+
+import numpy as np
+
+
+class ResultsFile:
+    """An append-only CSV file of the results of a hyperparameter search.
+
+    Each row holds the index of a configuration in its search, its theta and gamma, and the
+    score, solve time and play time it got. Rows are appended in batches as configurations
+    finish and flushed to disk, so a crashed search keeps every finished batch, can be resumed
+    by skipping the completed indices, and can be read while it is still running.
+    A row left half written by a crash is ignored when reading and dropped on the next append.
+    """
+    COLUMNS = ("index", "theta", "gamma", "score", "solve_time", "play_time")
+
+    def __init__(self, path):
+        """
+        Parameters:
+            path (str): The path of the CSV file, created on the first append.
+        """
+        self.path = path
+
+    def append(self, rows):
+        """Append a batch of rows and flush them to disk.
+
+        Args:
+            rows (list): Tuples with one value per column, in the order of COLUMNS.
+        """
+        new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+        if not new:
+            self._drop_partial_row()
+        with open(self.path, "a", newline="") as file:
+            writer = csv.writer(file)
+            if new:
+                writer.writerow(self.COLUMNS)
+            writer.writerows(rows)
+            file.flush()
+            os.fsync(file.fileno())
+
+    def completed(self):
+        """Get the indices of the configurations already in the file.
+
+        Returns:
+            (set): The completed indices.
+        """
+        return {int(index) for chunk in self.iter_chunks() for index in chunk["index"]}
+
+    def iter_chunks(self, chunk_size=10000):
+        """Read the file lazily, a chunk of rows at a time.
+
+        Args:
+            chunk_size (int): The largest number of rows per chunk.
+
+        Returns:
+            (iterator): Dicts mapping each column to an array of its values in the chunk.
+        """
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, newline="") as file:
+            # like _drop_partial_row, a last line without its newline was cut short by a crash,
+            # even if what was written of it parses
+            reader = csv.reader(line for line in file if line.endswith("\n"))
+            next(reader, None)
+            rows = []
+            for row in reader:
+                if len(row) != len(self.COLUMNS):
+                    continue
+                try:
+                    rows.append([float(value) for value in row])
+                except ValueError:
+                    continue
+                if len(rows) == chunk_size:
+                    yield self._to_columns(rows)
+                    rows = []
+            if rows:
+                yield self._to_columns(rows)
+
+    def read(self):
+        """Read every row of the file, sorted by index.
+
+        Returns:
+            (dict): A dict mapping each column to an array of its values.
+        """
+        chunks = list(self.iter_chunks())
+        if not chunks:
+            return self._to_columns([])
+        columns = {name: np.concatenate([chunk[name] for chunk in chunks]) for name in self.COLUMNS}
+        order = np.argsort(columns["index"], kind="stable")
+        return {name: values[order] for name, values in columns.items()}
+
+    def _to_columns(self, rows):
+        table = np.array(rows, dtype=float).reshape(len(rows), len(self.COLUMNS))
+        columns = {name: table[:, i] for i, name in enumerate(self.COLUMNS)}
+        columns["index"] = columns["index"].astype(np.int64)
+        return columns
+
+    def _drop_partial_row(self):
+        # a crash in the middle of a write leaves a last line without its newline
+        with open(self.path, "rb+") as file:
+            file.seek(-1, os.SEEK_END)
+            if file.read(1) == b"\n":
+                return
+            file.seek(0)
+            content = file.read()
+            file.seek(content.rfind(b"\n") + 1)
+            file.truncate()
@@ -1,12 +1,14 @@
-from functools import partial
-from scipy.stats import multinomial
+from fractions import Fraction
+
+import hashlib
+import math
 
 import numpy as np
 import itertools
 
 
 class DiceGame:
-    def __init__(self, dice=3, sides=6, values=None, bias=None, penalty=1):
+    def __init__(self, dice=3, sides=6, values=None, bias=None, penalty=1, fast=False, seed=None):
         self._dice = dice
         self._sides = sides
         self._penalty = penalty
@@ -33,18 +35,41 @@ class DiceGame:
 
         self.states = [a for a in itertools.combinations_with_replacement(self._values, self._dice)]
 
-        self.final_scores = {state: self.final_score(state) for state in self.states}
+        # integer ids are the positions in self.actions and self.states
+        self._action_ids = {action: i for i, action in enumerate(self.actions)}
+        self._state_ids = {state: i for i, state in enumerate(self.states)}
+
+        # face indices (0 to sides-1) of each state, and the table ranking them, see encode_states
+        self._state_faces = np.array(list(itertools.combinations_with_replacement(range(self._sides), self._dice)),
+                                     dtype=np.int64).reshape(len(self.states), self._dice)
+
+        self.final_scores = dict(zip(self.states, self._values[self._flip_faces(self._state_faces)].sum(axis=1)))
+        self._rank_table = _multiset_rank_table(self._sides, self._dice)
+        self._value_order = np.argsort(self._values, kind="stable")
+
+        self._transition_model = None
+        self._afterstate_model = None
+        self._fingerprint = None
+        # with fast=True, reset and roll read moves and scores from lookup tables, and draw faces
+        # in blocks from a generator seeded with seed instead of the global numpy random state
+        self._engine = FastEngine(self, seed) if fast else None
 
         self.reset()
 
     def reset(self):
         self._game_over = False
         self.score = self._penalty
-        self._current_dice = np.zeros(self._dice, dtype=np.int)
+        if self._engine is None:
+            self._current_dice = np.zeros(self._dice, dtype=np.int)
+        else:
+            # rerolling every die does not depend on the current state
+            self._state = 0
         _, dice, _ = self.roll()
         return dice
 
     def final_score(self, dice):
+        if type(dice) is tuple and dice in self.final_scores:
+            return self.final_scores[dice]
         uniques, counts = np.unique(dice, return_counts=True)
         uniques[counts > 1] = np.array([self._flip[x] for x in uniques[counts > 1]])
         return np.sum(uniques[counts == 1]) + np.sum(uniques[counts > 1] * counts[counts > 1])
@@ -57,17 +82,42 @@ class DiceGame:
         self._current_dice.sort()
 
     def roll(self, hold=()):
-        if hold not in self.actions:
+        action_id = self._action_ids.get(hold)
+        if action_id is None:
             raise ValueError("hold must be a valid tuple of dice indices")
 
         if self._game_over:
             return 0
 
+        reward, game_over = self._roll(action_id)
+        return reward, self.get_dice_state(), game_over
+
+    def roll_id(self, action_id):
+        """
+        Integer id equivalent of roll.
+
+        :param action_id: the id of the action, its index in self.actions
+        :return: reward, state_id, game_over, or 0 if the game is over
+        """
+        if not 0 <= action_id < len(self.actions):
+            raise ValueError("action_id must be a valid action id")
+
+        if self._game_over:
+            return 0
+
+        reward, game_over = self._roll(action_id)
+        return reward, self.get_dice_state_id(), game_over
+
+    def _roll(self, action_id):
+        if self._engine is not None:
+            return self._engine_roll(action_id)
+
+        hold = self.actions[action_id]
         count = len(hold)
         if count == self._dice:
             self._flip_duplicates()
             self.score += np.sum(self._current_dice)
-            return np.sum(self._current_dice), self.get_dice_state(), True
+            return np.sum(self._current_dice), True
         else:
             mask = np.ones(self._dice, dtype=np.bool)
             hold = np.array(hold, dtype=np.int)
@@ -77,11 +127,115 @@ class DiceGame:
             self._current_dice.sort()
 
             self.score -= self._penalty
-            return -1*self._penalty, self.get_dice_state(), False
+            return -1*self._penalty, False
+
+    def _engine_roll(self, action_id):
+        engine = self._engine
+        if engine.held[action_id] == self._dice:
+            reward = engine.final_scores[self._state]
+            self._state = engine.flipped[self._state]
+            self.score += reward
+            return reward, True
+        else:
+            self._state = engine.roll(self._state, action_id)
+            self.score -= self._penalty
+            return -1*self._penalty, False
 
     def get_dice_state(self):
+        if self._engine is not None:
+            return self.states[self._state]
         return tuple(self._current_dice)
 
+    def get_dice_state_id(self):
+        if self._engine is not None:
+            return self._state
+        return int(self.encode_states(self._current_dice[None, :])[0])
+
+    def get_state_id(self, state):
+        """
+        Get the integer id of a state, its index in self.states.
+
+        :param state: a sorted tuple of dice values
+        :return: the id of the state
+        """
+        if state not in self._state_ids:
+            raise ValueError("state must be a valid tuple of dice values")
+        return self._state_ids[state]
+
+    def get_state(self, state_id):
+        """
+        Get the state with the given integer id.
+
+        :param state_id: the id of the state
+        :return: the state as a sorted tuple of dice values
+        """
+        if not 0 <= state_id < len(self.states):
+            raise ValueError("state_id must be a valid state id")
+        return self.states[state_id]
+
+    def get_action_id(self, action):
+        """
+        Get the integer id of an action, its index in self.actions.
+
+        :param action: a tuple of held dice indices
+        :return: the id of the action
+        """
+        if action not in self._action_ids:
+            raise ValueError("action must be a valid tuple of dice indices")
+        return self._action_ids[action]
+
+    def get_action(self, action_id):
+        """
+        Get the action with the given integer id.
+
+        :param action_id: the id of the action
+        :return: the action as a tuple of held dice indices
+        """
+        if not 0 <= action_id < len(self.actions):
+            raise ValueError("action_id must be a valid action id")
+        return self.actions[action_id]
+
+    def encode_states(self, dice):
+        """
+        Rank many rolls of dice at once into state ids.
+
+        The id of a state is its rank in the lexicographic order of sorted
+        dice, computed with the combinatorial number system, so it matches
+        the index of the state in self.states without looking it up.
+
+        :param dice: an array of shape (n, dice) with dice values, in any order
+        :return: an array with the id of each row
+        """
+        dice = np.asarray(dice)
+        sorted_values = self._values[self._value_order]
+        positions = np.minimum(np.searchsorted(sorted_values, dice), self._sides - 1)
+        if np.any(sorted_values[positions] != dice):
+            raise ValueError("dice must hold valid dice values")
+        return self._rank_faces(np.sort(self._value_order[positions], axis=1))
+
+    def decode_states(self, state_ids):
+        """
+        Unrank many state ids at once, the inverse of encode_states.
+
+        :param state_ids: an array of state ids
+        :return: an array of shape (n, dice) with the sorted dice values of each state
+        """
+        return self._values[self._unrank_faces(np.asarray(state_ids, dtype=np.int64))]
+
+    def fingerprint(self):
+        """
+        Get a digest identifying the configuration of the game.
+
+        Two games with the same dice, sides, values, bias and penalty have the
+        same fingerprint, in this process or any other.
+
+        :return: a hexadecimal SHA-256 digest
+        """
+        if self._fingerprint is None:
+            config = repr((self._dice, self._sides, self._values.tolist(), self._bias.tolist(), self._penalty))
+            self._fingerprint = hashlib.sha256(config.encode()).hexdigest()
+        return self._fingerprint
+
     def get_next_states(self, action, dice_state):
         """
         Get all possible results of taking an action from a given state.
@@ -102,9 +256,9 @@ class DiceGame:
                     a list of size equal to state containing the probability of
                     each state occurring from this action
         """
-        if action not in self.actions:
+        if action not in self._action_ids:
             raise ValueError("action must be a valid tuple of dice indices")
-        if dice_state not in self.states:
+        if dice_state not in self._state_ids:
             raise ValueError("state must be a valid tuple of dice values")
 
         count = len(action)
@@ -131,8 +285,8 @@ class DiceGame:
             #   [[0, 0], [0, 1], ..., [5, 5]]
             # need to calculate the probability of each one, so will query a multinomial distribution
             # if dice show (1, 3) then the correct query format is index based: [1, 0, 1, 0, 0, 0]
-            queries = np.apply_along_axis(partial(np.bincount, minlength=self._sides), 1, other_index)
-            probabilities = multinomial.pmf(queries, self._dice - count, self._bias)
+            queries = _face_counts(other_index, self._sides)
+            probabilities = multinomial_pmf(queries, self._bias)
 
             other_vals = np.insert(other_vals, np.zeros(count, dtype=np.int),
                                    np.asarray(dice_state, dtype=np.int)[mask], axis=1)
@@ -143,6 +297,749 @@ class DiceGame:
 
             return other_vals, False, -1*self._penalty, probabilities
 
+    def get_transition_model(self):
+        """
+        Get the sparse transition model of the game, building it on first use.
+
+        The model holds the same information as calling get_next_states for
+        every (action, state) pair, but as flat arrays indexed by the position
+        of each state in self.states and each action in self.actions.
+
+        :return: a TransitionModel shared by every caller of this game
+        """
+        if self._transition_model is None:
+            self._transition_model = self._build_transition_model()
+        return self._transition_model
+
+    def set_transition_model(self, model):
+        """
+        Use an already built transition model, e.g. one shared by another process.
+
+        :param model: a TransitionModel of a game with the same configuration
+        """
+        if model.n_states != len(self.states) or model.n_actions != len(self.actions):
+            raise ValueError("transition model does not match the states and actions of the game")
+        self._transition_model = model
+
+    def get_afterstate_model(self):
+        """
+        Get the actions of the game grouped by the multiset of dice they hold, building it on first use.
+
+        :return: an AfterstateModel shared by every caller of this game
+        """
+        if self._afterstate_model is None:
+            self._afterstate_model = self._build_afterstate_model()
+        return self._afterstate_model
+
+    def get_truncated_transition_model(self, tolerance, max_outcomes=None):
+        """
+        Build an approximate transition model that drops the least likely outcomes of each action.
+
+        The outcomes of a reroll only depend on the number of dice rerolled, so they are
+        truncated once per count: the most likely ones are kept until their probability
+        reaches 1 - tolerance, and at most max_outcomes of them. The dropped probability is
+        not redistributed, so every backup on the model underestimates the exact one by at
+        most gamma * truncated_mass * max(values), see solvers.value_error_bound.
+
+        :param tolerance: the largest probability dropped from any row
+        :param max_outcomes: optional largest number of outcomes kept in any row
+        :return: a new TransitionModel, not shared with the game
+        """
+        if not 0 <= tolerance < 1:
+            raise ValueError("tolerance must be in [0, 1)")
+        if max_outcomes is not None and max_outcomes < 1:
+            raise ValueError("max_outcomes must be at least 1")
+        return self._build_transition_model(tolerance, max_outcomes)
+
+    def __getstate__(self):
+        # the transition model can be large, so it is rebuilt or set again by the receiving process
+        state = self.__dict__.copy()
+        state["_transition_model"] = None
+        state["_afterstate_model"] = None
+        return state
+
+    def with_parameters(self, bias=None, penalty=None):
+        """
+        Get a copy of the game with a new bias or penalty, reusing what does not change.
+
+        If the transition model of this game was built, the copy gets a model sharing
+        its arrays: a new bias only recomputes the probabilities of the outcomes, and
+        a new penalty only recomputes the rewards.
+
+        :param bias: the new bias of the dice, or None to keep the current one
+        :param penalty: the new penalty of a reroll, or None to keep the current one
+        :return: a new DiceGame
+        """
+        game = DiceGame(self._dice, self._sides, self._values,
+                        self._bias if bias is None else bias,
+                        self._penalty if penalty is None else penalty,
+                        fast=self._engine is not None)
+        model = self._transition_model
+        if model is not None:
+            probabilities = model.probabilities
+            if not np.array_equal(game._bias, self._bias):
+                probabilities = game._transition_probabilities(model.indptr)
+            rewards = model.rewards
+            if game._penalty != self._penalty:
+                rewards = game._transition_rewards(model.game_over, model.final_scores)
+            game._transition_model = TransitionModel(model.indptr, model.next_states, probabilities, rewards,
+                                                     model.game_over, model.final_scores, model.n_actions)
+        model = self._afterstate_model
+        if model is not None:
+            game._afterstate_model = AfterstateModel(model.lattice, model.indptr, model.afterstates, model.actions,
+                                                     model.positions, model.final_scores, game._bias, game._penalty)
+        return game
+
+    def _build_transition_model(self, tolerance=0.0, max_outcomes=None):
+        n_states = len(self.states)
+        n_actions = len(self.actions)
+        faces = self._state_faces
+        final_scores = self._final_score_table()
+
+        outcomes = {}
+        truncated_mass = 0.0
+        row_lengths = np.zeros((n_states, n_actions), dtype=np.int64)
+        for a, action in enumerate(self.actions):
+            rerolled = self._dice - len(action)
+            if rerolled > 0:
+                if rerolled not in outcomes:
+                    outcomes[rerolled] = self._reroll_outcomes(rerolled)
+                    if tolerance > 0 or max_outcomes is not None:
+                        outcomes[rerolled], dropped = _truncate_outcomes(*outcomes[rerolled], tolerance, max_outcomes)
+                        truncated_mass = max(truncated_mass, dropped)
+                row_lengths[:, a] = len(outcomes[rerolled][1])
+
+        indptr = np.zeros(n_states * n_actions + 1, dtype=np.int64)
+        np.cumsum(row_lengths.ravel(), out=indptr[1:])
+        next_states = np.empty(indptr[-1], dtype=np.int64)
+        game_over = np.zeros((n_states, n_actions), dtype=bool)
+
+        for a, action in enumerate(self.actions):
+            rerolled = self._dice - len(action)
+            if rerolled == 0:
+                game_over[:, a] = True
+                continue
+
+            other_index, pmf = outcomes[rerolled]
+            held = np.broadcast_to(faces[:, None, list(action)], (n_states, len(pmf), len(action)))
+            rolled = np.broadcast_to(other_index[None, :, :], (n_states, len(pmf), rerolled))
+            combined = np.sort(np.concatenate((held, rolled), axis=2), axis=2)
+
+            starts = indptr[np.arange(n_states) * n_actions + a]
+            next_states[starts[:, None] + np.arange(len(pmf))] = self._rank_faces(combined)
+
+        game_over = game_over.ravel()
+        return TransitionModel(indptr, next_states, self._transition_probabilities(indptr, outcomes),
+                               self._transition_rewards(game_over, final_scores), game_over, final_scores, n_actions,
+                               truncated_mass)
+
+    def _build_afterstate_model(self):
+        n_actions = len(self.actions)
+        lattice = MultisetLattice(self._sides, self._dice)
+        faces = self._state_faces
+        kept = np.stack([lattice.offsets[len(action)] + lattice.rank(faces[:, list(action)])
+                         for action in self.actions], axis=1)
+
+        # every action is represented by the first action of the state holding the same multiset
+        order = np.argsort(kept, axis=1, kind="stable")
+        sorted_kept = np.take_along_axis(kept, order, axis=1)
+        run_start = np.ones(sorted_kept.shape, dtype=bool)
+        run_start[:, 1:] = sorted_kept[:, 1:] != sorted_kept[:, :-1]
+        run_start = np.maximum.accumulate(np.where(run_start, np.arange(n_actions), 0), axis=1)
+        representatives = np.empty_like(kept)
+        np.put_along_axis(representatives, order, np.take_along_axis(order, run_start, axis=1), axis=1)
+
+        unique = representatives == np.arange(n_actions)
+        entries = (np.cumsum(unique.ravel()) - 1).reshape(unique.shape)
+        indptr = np.concatenate(([0], np.cumsum(unique.sum(axis=1))))
+        return AfterstateModel(lattice, indptr, kept[unique], np.nonzero(unique)[1],
+                               np.take_along_axis(entries, representatives, axis=1), self._final_score_table(),
+                               self._bias, self._penalty)
+
+    def _transition_probabilities(self, indptr, outcomes=None):
+        # probability of each outcome of the transition model, which only depends on the bias
+        outcomes = {} if outcomes is None else outcomes
+        n_states, n_actions = len(self.states), len(self.actions)
+        probabilities = np.empty(indptr[-1], dtype=float)
+        for a, action in enumerate(self.actions):
+            rerolled = self._dice - len(action)
+            if rerolled == 0:
+                continue
+            if rerolled not in outcomes:
+                outcomes[rerolled] = self._reroll_outcomes(rerolled)
+            _, pmf = outcomes[rerolled]
+            starts = indptr[np.arange(n_states) * n_actions + a]
+            probabilities[starts[:, None] + np.arange(len(pmf))] = pmf
+        return probabilities
+
+    def _transition_rewards(self, game_over, final_scores):
+        # reward of each row of the transition model, which only depends on the penalty
+        return np.where(game_over, np.repeat(final_scores, len(self.actions)), -1 * self._penalty).astype(float)
+
+    def simulate(self, policy, num_games, seed=None, max_rolls=None):
+        """
+        Play many games at once following a fixed policy.
+
+        The dice of every game are held in a single array and all games still
+        running are rerolled together with one draw from the random generator.
+        Scores follow the same rules as reset and roll.
+
+        :param policy: an array with the index in self.actions to take in each state of self.states
+        :param num_games: the number of games to play
+        :param seed: seed or numpy Generator for the random draws
+        :param max_rolls: if given, games still running after this many rerolls stick with their dice
+        :return: scores, rolls
+                 scores:
+                    an array with the final score of each game
+                 rolls:
+                    an array with the number of rerolls taken in each game
+        """
+        rng = np.random.default_rng(seed)
+        policy = np.asarray(policy)
+        final_scores = self._final_score_table()
+        held = np.zeros((len(self.actions), self._dice), dtype=bool)
+        for a, action in enumerate(self.actions):
+            held[a, list(action)] = True
+        sticks = held.all(axis=1)
+
+        faces = np.sort(rng.choice(self._sides, size=(num_games, self._dice), p=self._bias), axis=1)
+        scores = np.zeros(num_games, dtype=float)
+        rolls = np.zeros(num_games, dtype=np.int64)
+        active = np.arange(num_games)
+        while active.size:
+            states = self._rank_faces(faces[active])
+            actions = policy[states]
+            done = sticks[actions]
+            if max_rolls is not None:
+                done |= rolls[active] >= max_rolls
+            scores[active[done]] += final_scores[states[done]]
+            active, actions = active[~done], actions[~done]
+
+            draws = rng.choice(self._sides, size=(active.size, self._dice), p=self._bias)
+            faces[active] = np.sort(np.where(held[actions], faces[active], draws), axis=1)
+            scores[active] -= self._penalty
+            rolls[active] += 1
+
+        return scores, rolls
+
+    def _rank_faces(self, faces):
+        # id of each sorted row of face indices
+        return _rank_multisets(self._rank_table, faces)
+
+    def _unrank_faces(self, state_ids):
+        return _unrank_multisets(self._rank_table, state_ids)
+
+    def _flip_faces(self, faces):
+        # face indices after sticking, where a face shown by more than one die becomes the mirrored face
+        duplicated = (faces[..., :, None] == faces[..., None, :]).sum(axis=-1) > 1
+        return np.where(duplicated, self._sides - 1 - faces, faces)
+
+    def _final_score_table(self):
+        return np.array([self.final_scores[state] for state in self.states], dtype=float)
+
+    def _reroll_outcomes(self, count):
+        # every multiset of face indices for `count` rerolled dice, with its probability
+        other_index = np.array(list(itertools.combinations_with_replacement(range(self._sides), count)),
+                               dtype=np.int64)
+        return other_index, multinomial_pmf(_face_counts(other_index, self._sides), self._bias)
+
+
+def _truncate_outcomes(other_index, pmf, tolerance, max_outcomes=None):
+    # keep the most likely outcomes until the dropped probability is at most tolerance, in their original order
+    order = np.argsort(-pmf, kind="stable")
+    kept = int(np.searchsorted(np.cumsum(pmf[order]), 1 - tolerance)) + 1
+    kept = min(kept, len(pmf), max_outcomes or len(pmf))
+    keep = np.sort(order[:kept])
+    dropped = max(0.0, 1.0 - float(pmf[keep].sum()))
+    return (other_index[keep], pmf[keep]), dropped
+
+
+# n! for every n whose factorial is finite as a float
+_FACTORIALS = np.array([math.factorial(n) for n in range(171)], dtype=float)
+
+
+def multinomial_pmf(counts, bias, exact=False):
+    """
+    Probability of rolling each face-count histogram, n! / (k_1! ... k_s!) * p_1^k_1 ... p_s^k_s.
+
+    Replaces scipy.stats.multinomial.pmf: the coefficients come from a table of
+    factorials (logarithms past 170 dice) and the whole batch of histograms is
+    computed with array operations.
+
+    :param counts: an array of shape (n, sides), the number of dice showing each face in each outcome
+    :param bias: the probability of each face
+    :param exact: if True, compute with integers and fractions instead of floats, for verification;
+                  float biases are converted to the exact rationals they hold
+    :return: an array with the probability of each row, of Fraction objects if exact
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    if exact:
+        bias = [Fraction(p) for p in bias]
+        probabilities = []
+        for row in counts.reshape(-1, counts.shape[-1]).tolist():
+            coefficient = math.factorial(sum(row))
+            for count in row:
+                coefficient //= math.factorial(count)
+            probability = Fraction(coefficient)
+            for p, count in zip(bias, row):
+                probability *= p ** count
+            probabilities.append(probability)
+        return np.array(probabilities, dtype=object).reshape(counts.shape[:-1])
+
+    bias = np.asarray(bias, dtype=float)
+    totals = counts.sum(axis=-1)
+    if totals.size == 0 or totals.max() < len(_FACTORIALS):
+        return _FACTORIALS[totals] / np.prod(_FACTORIALS[counts], axis=-1) * np.prod(bias ** counts, axis=-1)
+
+    # too many dice for float factorials, so work with logarithms, log(n!) being a cumulative sum
+    log_factorials = np.concatenate(([0.0], np.cumsum(np.log(np.arange(1, totals.max() + 1)))))
+    with np.errstate(divide="ignore"):
+        log_bias = np.log(bias)
+    log_powers = np.sum(np.where(counts > 0, counts * log_bias, 0.0), axis=-1)
+    return np.exp(log_factorials[totals] - np.sum(log_factorials[counts], axis=-1) + log_powers)
+
+
+def _face_counts(faces, sides):
+    # histogram of the face indices of each row
+    return (np.asarray(faces)[..., None] == np.arange(sides)).sum(axis=-2)
+
+
+def _multiset_rank_table(sides, size):
+    # A sorted row of faces f_0 <= ... <= f_k-1 maps to the combination c_j = f_j + j of
+    # range(sides + size - 1). The lexicographic rank of that combination counts, for each
+    # position j, the combinations that take a smaller value x at j, which is
+    # comb(n - 1 - x, size - 1 - j) for every x between c_j-1 + 1 and c_j - 1.
+    # table[j, f] holds the sum of those counts for x below f + j.
+    n = sides + size - 1
+    table = np.zeros((size, sides + 1), dtype=np.int64)
+    for j in range(size):
+        counts = [math.comb(n - 1 - x, size - 1 - j) for x in range(j, sides + j)]
+        table[j, 1:] = np.cumsum(counts)
+    return table
+
+
+def _rank_multisets(table, faces):
+    # lexicographic rank of each sorted row of face indices
+    previous = np.zeros_like(faces)
+    previous[..., 1:] = faces[..., :-1]
+    positions = np.arange(table.shape[0])
+    return np.sum(table[positions, faces] - table[positions, previous], axis=-1)
+
+
+def _unrank_multisets(table, ranks):
+    # sorted face indices of each rank, picking at each position the largest face
+    # whose rank offset does not exceed what is left of the rank
+    faces = np.zeros(ranks.shape + (table.shape[0],), dtype=np.int64)
+    remaining = ranks.copy()
+    previous = np.zeros_like(ranks)
+    for j in range(table.shape[0]):
+        base = table[j, previous]
+        faces[..., j] = np.searchsorted(table[j], remaining + base, side="right") - 1
+        remaining -= table[j, faces[..., j]] - base
+        previous = faces[..., j]
+    return faces
+
+
+class TransitionModel:
+    """Sparse transition structure of a DiceGame in compressed sparse row (CSR) layout.
+
+    Each (state, action) pair owns the row ``state * n_actions + action``, where
+    state and action are positions in ``DiceGame.states`` and ``DiceGame.actions``.
+    The outcomes of a row are stored in ``next_states[indptr[row]:indptr[row + 1]]``
+    (indices into ``DiceGame.states``) with matching ``probabilities``.
+    Rows of actions that hold every die are terminal: they have no outcomes,
+    ``game_over`` is True and ``rewards`` holds the final score of the state.
+    """
+    ARRAYS = ("indptr", "next_states", "probabilities", "rewards", "game_over", "final_scores")
+
+    def __init__(self, indptr, next_states, probabilities, rewards, game_over, final_scores, n_actions,
+                 truncated_mass=0.0):
+        """
+        Parameters:
+            indptr (np.ndarray): Offsets of each row into next_states and probabilities.
+            next_states (np.ndarray): Index of the resulting state of each outcome.
+            probabilities (np.ndarray): Probability of each outcome.
+            rewards (np.ndarray): Reward of each row.
+            game_over (np.ndarray): Whether each row ends the game.
+            final_scores (np.ndarray): Final score of each state.
+            n_actions (int): Number of actions available in every state.
+            truncated_mass (float): Largest probability missing from a row, for a model built by
+                DiceGame.get_truncated_transition_model, 0 for an exact model.
+        """
+        self.indptr = indptr
+        self.next_states = next_states
+        self.probabilities = probabilities
+        self.rewards = rewards
+        self.game_over = game_over
+        self.final_scores = final_scores
+        self.n_states = len(final_scores)
+        self.n_actions = n_actions
+        self.truncated_mass = truncated_mass
+
+    @property
+    def nbytes(self):
+        """Total size in bytes of the arrays held by the model."""
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS)
+
+    def row(self, state, action):
+        """Get the row index of the given state and action indices."""
+        return state * self.n_actions + action
+
+    def get_next_states(self, action, state):
+        """
+        Index based equivalent of DiceGame.get_next_states.
+
+        :param action: index of the action in DiceGame.actions
+        :param state: index of the state in DiceGame.states
+        :return: next_states, game_over, reward, probabilities
+                 next_states is an array of state indices, empty if game_over
+        """
+        row = self.row(state, action)
+        start, end = self.indptr[row], self.indptr[row + 1]
+        return self.next_states[start:end], self.game_over[row], self.rewards[row], self.probabilities[start:end]
+
+
+class AfterstateModel:
+    """The actions of a DiceGame grouped by afterstate, the multiset of dice they hold.
+
+    Actions holding the same faces of a state, such as (0, 1) and (0, 2) in (2, 2, 5), reach
+    the same afterstate and have the same value, and many states share each afterstate.
+    Every state keeps one entry per distinct afterstate, for the first of its actions reaching
+    it, stored in ``afterstates[indptr[state]:indptr[state + 1]]`` as global ids of a
+    MultisetLattice whose top level are the states, with the index of that action in
+    ``actions``. The afterstate of holding every die is the state itself and ends the game.
+    """
+    ARRAYS = ("indptr", "afterstates", "actions", "positions", "final_scores", "rewards", "game_over")
+
+    def __init__(self, lattice, indptr, afterstates, actions, positions, final_scores, bias, penalty):
+        """
+        Parameters:
+            lattice (MultisetLattice): The lattice of the multisets of dice of the game.
+            indptr (np.ndarray): Offsets of the entries of each state.
+            afterstates (np.ndarray): Global lattice id of the afterstate of each entry.
+            actions (np.ndarray): Index in DiceGame.actions of the action of each entry.
+            positions (np.ndarray): Entry of each (state, action) pair, of shape (n_states, n_actions).
+            final_scores (np.ndarray): Final score of each state.
+            bias (np.ndarray): The probability of each face.
+            penalty (float): The cost of a reroll.
+        """
+        self.lattice = lattice
+        self.indptr = indptr
+        self.afterstates = afterstates
+        self.actions = actions
+        self.positions = positions
+        self.final_scores = final_scores
+        self.bias = bias
+        self.penalty = penalty
+        self.n_states, self.n_actions = positions.shape
+
+        states = afterstates - lattice.offsets[lattice.size]
+        self.game_over = states >= 0
+        self.rewards = np.where(self.game_over, final_scores[np.maximum(states, 0)], -1 * penalty).astype(float)
+
+    @property
+    def nbytes(self):
+        """Total size in bytes of the arrays held by the model and the lattice tables built so far."""
+        return sum(getattr(self, name).nbytes for name in self.ARRAYS) + self.lattice.nbytes
+
+
+class FastEngine:
+    """Lookup tables and buffered random faces behind the fast mode of DiceGame.
+
+    States are tracked by id. Rerolling goes through a MultisetLattice: the dice held by an
+    action form a multiset read from a (state, action) table, and each rerolled die adds one
+    face to it through the lattice's children tables, ending on the id of the next state.
+    Faces come from a buffer refilled in blocks from a numpy Generator, and the tables are
+    Python lists, so a roll makes no numpy call and allocates no array.
+    """
+    BLOCK_SIZE = 1 << 16
+
+    def __init__(self, game, seed=None):
+        """
+        Parameters:
+            game (DiceGame): The game to build the tables of.
+            seed (int): Seed or numpy Generator for the random faces.
+        """
+        lattice = MultisetLattice(game._sides, game._dice)
+        faces = game._state_faces
+        self.dice = game._dice
+        self.held = [len(action) for action in game.actions]
+        self.kept = np.stack([lattice.rank(faces[:, list(action)]) for action in game.actions], axis=1).tolist()
+        self.children = [lattice.children(level).tolist() for level in range(game._dice)]
+
+        flipped = np.sort(game._flip_faces(faces), axis=1)
+        self.flipped = game._rank_faces(flipped).tolist()
+        self.final_scores = game._values[flipped].sum(axis=1).tolist()
+
+        self._rng = np.random.default_rng(seed)
+        self._sides = game._sides
+        self._bias = game._bias
+        self._faces = []
+        self._position = 0
+
+    def roll(self, state, action):
+        """Get the id of the state reached by rerolling the dice not held by an action."""
+        faces, position = self._faces, self._position
+        if position + self.dice > len(faces):
+            faces, position = self._refill(), 0
+        rank = self.kept[state][action]
+        for level in range(self.held[action], self.dice):
+            rank = self.children[level][rank][faces[position]]
+            position += 1
+        self._position = position
+        return rank
+
+    def _refill(self):
+        # faces left over in the old block are independent draws, so they can be dropped
+        self._faces = self._rng.choice(self._sides, size=self.BLOCK_SIZE, p=self._bias).tolist()
+        return self._faces
+
+
+class MultisetLattice:
+    """Every multiset of up to `size` dice faces, ranked level by level.
+
+    Level k holds the comb(sides + k - 1, k) multisets of k faces, each identified by its
+    lexicographic rank among the sorted rows of k face indices, so the top level ranks
+    states the same way as DiceGame. Multisets are also given a global id,
+    ``offsets[k] + rank``, unique across levels.
+    The tables linking neighbouring levels are built on first use and kept.
+    """
+    def __init__(self, sides, size):
+        """
+        Parameters:
+            sides (int): The number of faces of a die.
+            size (int): The number of faces of the largest multisets.
+        """
+        self.sides = sides
+        self.size = size
+        self.sizes = [math.comb(sides + k - 1, k) for k in range(size + 1)]
+        self.offsets = np.concatenate(([0], np.cumsum(self.sizes)))
+        self._rank_tables = [_multiset_rank_table(sides, k) for k in range(size + 1)]
+        self._children = {}
+        self._parents = {}
+
+    def rank(self, faces):
+        """Rank sorted rows of face indices within the level of their length."""
+        faces = np.asarray(faces, dtype=np.int64)
+        return _rank_multisets(self._rank_tables[faces.shape[-1]], faces)
+
+    def unrank(self, level, ranks):
+        """Get the sorted face indices of the multisets with the given ranks in a level."""
+        return _unrank_multisets(self._rank_tables[level], np.asarray(ranks, dtype=np.int64))
+
+    def counts(self, level, ranks):
+        """Get the face-count histograms of the multisets with the given ranks in a level."""
+        faces = self.unrank(level, ranks)
+        return (faces[..., None] == np.arange(self.sides)).sum(axis=-2)
+
+    def level_of(self, global_ids):
+        """Split global ids into their levels and ranks within the level."""
+        levels = np.searchsorted(self.offsets, global_ids, side="right") - 1
+        return levels, global_ids - self.offsets[levels]
+
+    def children(self, level):
+        """Get, for each multiset of a level and each face, the rank of the multiset with that face added."""
+        if level not in self._children:
+            faces = self.unrank(level, np.arange(self.sizes[level]))
+            children = np.empty((self.sizes[level], self.sides), dtype=np.int32)
+            for face in range(self.sides):
+                added = np.concatenate((faces, np.full((len(faces), 1), face)), axis=1)
+                children[:, face] = self.rank(np.sort(added, axis=1))
+            self._children[level] = children
+        return self._children[level]
+
+    def parents(self, level):
+        """Get, for each multiset of a level and each face, the rank of the multiset with one such face
+        removed, or -1 if the multiset does not hold that face."""
+        if level not in self._parents:
+            children = self.children(level - 1)
+            parents = np.full((self.sizes[level], self.sides), -1, dtype=np.int32)
+            ranks = np.broadcast_to(np.arange(self.sizes[level - 1])[:, None], children.shape)
+            parents[children, np.arange(self.sides)] = ranks
+            self._parents[level] = parents
+        return self._parents[level]
+
+    @property
+    def nbytes(self):
+        """Total size in bytes of the tables built so far."""
+        tables = list(self._children.values()) + list(self._parents.values())
+        return sum(table.nbytes for table in tables)
+
+
+class CountDiceGame:
+    """A DiceGame where states are face-count histograms and actions say how many of each face to keep.
+
+    A state is a tuple with the number of dice showing each face, in the order of the values.
+    An action is a tuple of the same length with how many of each face to hold, and holding
+    every die sticks. Equivalent tuple-of-indices actions of DiceGame collapse into one,
+    and no list of states or actions is built: they are generated on demand, and solvers
+    work on a MultisetLattice whose size grows with the number of states only.
+    """
+    def __init__(self, dice=3, sides=6, values=None, bias=None, penalty=1):
+        self._dice = dice
+        self._sides = sides
+        self._penalty = penalty
+        if values is None:
+            self._values = np.arange(1, self._sides + 1)
+        else:
+            if len(values) != sides:
+                raise ValueError("Length of values must equal sides")
+            self._values = np.array(values)
+
+        if bias is None:
+            self._bias = np.ones(self._sides)/self._sides
+        else:
+            self._bias = np.array(bias)
+
+        if len(self._values) != len(self._bias):
+            raise ValueError("Dice values and biases must be equal length")
+
+        # a face shown by more than one die is flipped to the face at the mirrored position
+        self._flipped_values = self._values[::-1]
+        self._rank_table = _multiset_rank_table(self._sides, self._dice)
+        self._lattice = None
+
+        self.reset()
+
+    @property
+    def num_states(self):
+        return math.comb(self._sides + self._dice - 1, self._dice)
+
+    @property
+    def bias(self):
+        return self._bias
+
+    @property
+    def penalty(self):
+        return self._penalty
+
+    def iter_states(self):
+        """
+        Generate every state in id order.
+
+        :return: an iterator over face-count tuples
+        """
+        for faces in itertools.combinations_with_replacement(range(self._sides), self._dice):
+            yield self._faces_to_counts(faces)
+
+    def iter_actions(self, state):
+        """
+        Generate every distinct action available in a state, ending with holding every die.
+
+        :param state: a face-count tuple
+        :return: an iterator over tuples of how many of each face to keep
+        """
+        return itertools.product(*(range(count + 1) for count in state))
+
+    def get_lattice(self):
+        """
+        Get the lattice of multisets of faces of the game, whose top level are the states.
+
+        :return: a MultisetLattice shared by every caller of this game
+        """
+        if self._lattice is None:
+            self._lattice = MultisetLattice(self._sides, self._dice)
+        return self._lattice
+
+    def get_state_id(self, state):
+        self._check_state(state)
+        faces = np.repeat(np.arange(self._sides), state)
+        return int(_rank_multisets(self._rank_table, faces))
+
+    def get_state(self, state_id):
+        if not 0 <= state_id < self.num_states:
+            raise ValueError("state_id must be a valid state id")
+        faces = _unrank_multisets(self._rank_table, np.array(state_id))
+        return self._faces_to_counts(faces)
+
+    def final_score(self, state):
+        counts = np.asarray(state)
+        return np.sum(counts * np.where(counts > 1, self._flipped_values, self._values))
+
+    def final_scores(self, counts):
+        """
+        Get the final score of many states at once.
+
+        :param counts: an array of shape (n, sides) with one face-count histogram per row
+        :return: an array with the final score of each row
+        """
+        return np.sum(counts * np.where(counts > 1, self._flipped_values, self._values), axis=-1)
+
+    def reset(self):
+        self._game_over = False
+        self.score = self._penalty
+        self._current_counts = np.zeros(self._sides, dtype=np.int64)
+        _, counts, _ = self.roll(tuple(self._current_counts))
+        return counts
+
+    def roll(self, keep=None):
+        """
+        Hold some dice and reroll the others, or stick if every die is held.
+
+        :param keep: a tuple of how many of each face to hold, all zeros by default
+        :return: reward, state, game_over, or 0 if the game is over
+        """
+        if keep is None:
+            keep = (0,) * self._sides
+        self._check_action(keep, self.get_dice_state())
+
+        if self._game_over:
+            return 0
+
+        kept = np.asarray(keep, dtype=np.int64)
+        rerolled = self._dice - kept.sum()
+        if rerolled == 0:
+            reward = self.final_score(self._current_counts)
+            self._current_counts = self._flip_duplicates(self._current_counts)
+            self.score += reward
+            return reward, self.get_dice_state(), True
+        else:
+            self._current_counts = kept + np.random.multinomial(rerolled, self._bias)
+            self.score -= self._penalty
+            return -1*self._penalty, self.get_dice_state(), False
+
+    def get_dice_state(self):
+        return tuple(int(count) for count in self._current_counts)
+
+    def get_next_states(self, action, state):
+        """
+        Get all possible results of taking an action from a given state.
+
+        :param action: a tuple of how many of each face to keep
+        :param state: a face-count tuple
+        :return: states, game_over, reward, probabilities, in the same format as DiceGame.get_next_states
+        """
+        self._check_state(state)
+        self._check_action(action, state)
+
+        kept = np.asarray(action, dtype=np.int64)
+        rerolled = self._dice - kept.sum()
+        if rerolled == 0:
+            return [None], True, self.final_score(state), np.array([1])
+
+        table = _multiset_rank_table(self._sides, rerolled)
+        faces = _unrank_multisets(table, np.arange(math.comb(self._sides + rerolled - 1, rerolled)))
+        counts = _face_counts(faces, self._sides)
+        probabilities = multinomial_pmf(counts, self._bias)
+        return [tuple(int(c) for c in row) for row in counts + kept], False, -1*self._penalty, probabilities
+
+    def _flip_duplicates(self, counts):
+        flipped = np.where(counts > 1, 0, counts)
+        duplicates = np.flatnonzero(counts > 1)
+        flipped[self._sides - 1 - duplicates] += counts[duplicates]
+        return flipped
+
+    def _faces_to_counts(self, faces):
+        return tuple(int(count) for count in np.bincount(np.asarray(faces, dtype=np.int64), minlength=self._sides))
+
+    def _check_state(self, state):
+        if len(state) != self._sides or min(state) < 0 or sum(state) != self._dice:
+            raise ValueError("state must be a valid tuple of face counts")
+
+    def _check_action(self, action, state):
+        if len(action) != self._sides or any(k < 0 or k > c for k, c in zip(action, state)):
+            raise ValueError("action must be a valid tuple of face counts to keep")
+
 
 def main():
     print("Let's play the game!")